@@ -68,6 +68,9 @@ if USE_SIMULATION:
     
     print("[SIMULATION] Using simulation mode with random data for testing")
 
+# EEG channels of the Unicorn Hybrid Black, in the order get_data returns them
+UNICORN_CHANNELS = ["Fz", "C3", "Cz", "C4", "Pz", "PO7", "Oz", "PO8"]
+
 # Direction mapping
 # 1: Up
 # 2: Down
@@ -96,6 +99,8 @@ calibration_mode = True
 recording_data = False
 recorded_values = []
 last_detection = None
+# EEGRecorder writing the raw EEG with --record, else None
+recorder = None
 detection_cooldown = 0
 keyboard_control = False
 
@@ -130,6 +135,15 @@ def update_image_viewer(direction):
     except Exception as e:
         print(f"Error writing to direction file: {str(e)}")
 
+def mark_recording(label):
+    """Add an event marker to the --record file, if recording"""
+    if recorder is not None:
+        recorder.mark(label)
+
+def mark_calibration_toggle():
+    """Marker for SPACE starting or stopping the recording of a direction"""
+    mark_recording(f"{'start' if recording_data else 'stop'} {DIRECTION_NAMES[current_direction]}")
+
 def on_key_press(key):
     global current_direction, calibration_mode, recording_data, recorded_values, detection_frame_rate
     
@@ -174,6 +188,7 @@ def on_key_press(key):
                 return
                 
             recording_data = not recording_data
+            mark_calibration_toggle()
             if recording_data:
                 recorded_values = []
                 print(f"\n▶ RECORDING brainwave values for {DIRECTION_NAMES[current_direction]}... Focus on the displayed image")
@@ -209,6 +224,7 @@ def on_key_press(key):
         # Toggle calibration mode
         elif key_char == 'c':
             calibration_mode = not calibration_mode
+            mark_recording("calibration mode on" if calibration_mode else "calibration mode off")
             if calibration_mode:
                 print("\n🔧 ENTERED CALIBRATION MODE 🔧")
                 print("1. Use keys 1-8 to select a direction")
@@ -427,7 +443,8 @@ def reset_rolling_data():
     print("\n🔄 Reset data buffer - starting fresh data collection")
     print(f"Will make guesses after collecting {min_samples_required} samples (about 1 minute)...")
 
-def main():
+def main(record_path=None):
+    global recorder
     # Initialize Unicorn device
     unicorn = None
     try:
@@ -438,6 +455,14 @@ def main():
         # Start acquisition
         unicorn.start()
         
+        if record_path:
+            # Raw samples go to a memory-mapped file, written on the recorder's own thread
+            sys.path.append(os.path.join(current_dir, "..", "backend"))
+            from eeg_recorder import EEGRecorder
+            recorder = EEGRecorder(record_path, UNICORN_CHANNELS, getattr(unicorn, "sample_rate", 250))
+            recorder.start()
+            print(f"Recording raw EEG to {record_path}")
+        
         # Load the user's calibration values
         global brainwave_ranges, calibration_mode, frame_timer, collection_start_time
         frame_timer = 0  # Initialize frame timer
@@ -554,6 +579,8 @@ def main():
                 # Get data from Unicorn device
                 try:
                     data = unicorn.get_data(0.2)  # Get 0.2 seconds worth of data
+                    if recorder is not None and data is not None:
+                        recorder.append(np.asarray(data)[:len(UNICORN_CHANNELS)])
                     
                     # Direct keyboard event checking as backup
                     # Check for spacebar directly using the keyboard module
@@ -568,6 +595,7 @@ def main():
                         if current_direction is not None:
                             global recording_data, recorded_values
                             recording_data = not recording_data
+                            mark_calibration_toggle()
                             if recording_data:
                                 recorded_values = []
                                 print(f"\n▶ RECORDING brainwave values for {DIRECTION_NAMES[current_direction]}... Focus on the displayed image")
@@ -786,6 +814,10 @@ def main():
     
     finally:
         # Clean up
+        if recorder is not None:
+            recorder.stop()
+            print(f"Recorded {recorder.samples} samples to {recorder.path}")
+            recorder = None
         if unicorn and unicorn.running:
             print("Stopping data acquisition...")
             try:
@@ -795,8 +827,13 @@ def main():
                 print("Error stopping device")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Control the image viewer with the Unicorn headset")
+    parser.add_argument("--record", metavar="PATH",
+                        help="also record the raw EEG to this file (see backend/eeg_recorder.py)")
+    args = parser.parse_args()
     try:
-        main()
+        main(record_path=args.record)
     except KeyboardInterrupt:
         print("\nProgram terminated by user")
     except Exception as e:
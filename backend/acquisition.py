@@ -0,0 +1,144 @@
+"""
+Continuous EEG acquisition.
+
+A background thread reads small blocks from the device, runs them through
+the optional filter stage (see dsp.FilterBank) and appends them to a
+preallocated ring buffer, so the analysis never waits for the device and
+consecutive windows share samples: a 1 s window can be re-analysed at any
+rate up to one update per block.
+
+The buffer is stored twice side by side (channels x 2 * capacity) and every
+block is written to both halves. The last n samples are then always one
+contiguous slice, which latest() returns as a view without copying.
+"""
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+# Seconds to wait before reading again after the device raised
+READ_ERROR_DELAY = 0.5
+
+class RingBuffer:
+    """
+    Fixed-size multichannel sample buffer.
+
+    A view returned by latest(n) stays valid until capacity - n more samples
+    have been written, so analyses must finish well within that time.
+
+    Args:
+        channels: Number of channels
+        capacity: Samples kept per channel
+    """
+    def __init__(self, channels: int, capacity: int, dtype=np.float64):
+        self.channels = channels
+        self.capacity = capacity
+        self.data = np.zeros((channels, 2 * capacity), dtype=dtype)
+        self.head = 0  # next write position, in [0, capacity)
+        self.total = 0  # samples written since the last clear
+        self.updated = 0.0  # time.monotonic() of the last write
+        self._lock = threading.Lock()
+
+    def write(self, block: np.ndarray):
+        """Append a (channels, samples) block, overwriting the oldest samples"""
+        samples = block.shape[1]
+        if samples > self.capacity:
+            block = block[:, -self.capacity:]
+            samples = self.capacity
+        capacity, head = self.capacity, self.head
+        first = min(samples, capacity - head)
+        self.data[:, head:head + first] = block[:, :first]
+        self.data[:, head + capacity:head + capacity + first] = block[:, :first]
+        rest = samples - first
+        if rest:
+            self.data[:, :rest] = block[:, first:]
+            self.data[:, capacity:capacity + rest] = block[:, first:]
+        with self._lock:
+            self.head = (head + samples) % capacity
+            self.total += samples
+            self.updated = time.monotonic()
+
+    def latest(self, samples: int) -> Optional[np.ndarray]:
+        """View of the last samples per channel, oldest first; None until that many were written"""
+        head, total = self.position()
+        if total < samples:
+            return None
+        return self.view(head, samples)
+
+    def position(self) -> Tuple[int, int]:
+        """(head, total) of the last write, for reading with view() while the writer goes on"""
+        with self._lock:
+            return self.head, self.total
+
+    def view(self, head: int, samples: int) -> np.ndarray:
+        """View of the samples ending at a head returned by position()"""
+        end = head + self.capacity
+        return self.data[:, end - samples:end]
+
+    def clear(self):
+        with self._lock:
+            self.head = 0
+            self.total = 0
+            self.updated = 0.0
+
+class Acquisition:
+    """
+    Thread streaming blocks from a device into a RingBuffer.
+
+    Args:
+        device: Object with get_data(samples) returning a (channels, samples) array
+        buffer: Buffer the blocks are appended to
+        block_size: Samples read per call; also the finest update granularity
+        filter_bank: Object with process(block) and reset(), applied to every block
+
+    Set recorder to an object with append(block, timestamp) (see
+    eeg_recorder.EEGRecorder) to receive every raw block before filtering.
+    """
+    def __init__(self, device: Any, buffer: RingBuffer, block_size: int, filter_bank: Optional[Any] = None):
+        self.device = device
+        self.buffer = buffer
+        self.block_size = block_size
+        self.filter_bank = filter_bank
+        self.recorder: Optional[Any] = None
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self.buffer.clear()
+        if self.filter_bank is not None:
+            self.filter_bank.reset()
+        self._thread = threading.Thread(target=self._run, name="bci-acquisition", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                block = self.device.get_data(self.block_size)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error reading from the BCI device: {e}")
+                self._stop.wait(READ_ERROR_DELAY)
+                continue
+            received = time.monotonic()
+            block = np.asarray(block, dtype=float)
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.append(block, received)
+            if self.filter_bank is not None:
+                block = self.filter_bank.process(block)
+            self.buffer.write(block)
@@ -0,0 +1,172 @@
+"""
+In-memory static asset serving.
+
+build_assets.py writes static/dist/: content-hashed copies of the assets
+(served under /assets/ with Cache-Control: immutable), gzip/brotli variants
+of the text files, a sprite sheet of the UI images and the HTML pages
+rewritten to use them. AssetStore loads all of it into memory once, so
+requests never touch the disk, and picks the encoding from Accept-Encoding.
+
+Without a build, or when a source file changed since the build (the manifest
+records their content hashes), the pages are read from static/ once and
+compressed at startup; everything else is still served by the /static mount.
+"""
+import gzip
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+from starlette.responses import Response
+
+# Preferred first
+ENCODINGS = ("br", "gzip")
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".json": "application/json",
+    ".png": "image/png",
+    ".svg": "image/svg+xml",
+}
+
+# Hashed assets never change under the same URL; pages must be revalidated
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+class Asset:
+    """
+    One asset with its encoded variants.
+
+    Args:
+        content_type: Media type of the identity body
+        bodies: Body per content coding ("identity", "gzip", "br")
+        etag: Content hash of the identity body (unquoted)
+        cache_control: Cache-Control header value
+    """
+    def __init__(self, content_type: str, bodies: Dict[str, bytes], etag: str, cache_control: str):
+        self.content_type = content_type
+        self.bodies = bodies
+        self.etag = etag
+        self.cache_control = cache_control
+
+    def choose_encoding(self, accept_encoding: str) -> str:
+        """The best coding the client accepts, falling back to identity"""
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            quality = params.strip()
+            if quality.startswith("q="):
+                try:
+                    if float(quality[2:]) == 0:
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(coding.strip().lower())
+        for coding in ENCODINGS:
+            if coding in self.bodies and (coding in accepted or "*" in accepted):
+                return coding
+        return "identity"
+
+    def response(self, headers) -> Response:
+        """Response for a request, honouring Accept-Encoding and If-None-Match"""
+        coding = self.choose_encoding(headers.get("accept-encoding", ""))
+        # Each representation needs its own strong validator
+        etag = f'"{self.etag}"' if coding == "identity" else f'"{self.etag}-{coding}"'
+        response_headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if len(self.bodies) > 1:
+            response_headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            if "*" in tags or etag in tags or "W/" + etag in tags:
+                return Response(status_code=304, headers=response_headers)
+
+        if coding != "identity":
+            response_headers["Content-Encoding"] = coding
+        return Response(self.bodies[coding], media_type=self.content_type, headers=response_headers)
+
+def content_type(filename: str) -> str:
+    return CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+class AssetStore:
+    """
+    Pages and hashed assets held in memory.
+
+    Args:
+        static_dir: Source directory of the frontend
+        dist_dir: Output directory of build_assets.py (manifest.json inside)
+    """
+    def __init__(self, static_dir: str = "static", dist_dir: str = "static/dist"):
+        self.static_dir = static_dir
+        self.dist_dir = dist_dir
+        self.pages: Dict[str, Asset] = {}
+        self.assets: Dict[str, Asset] = {}
+        self.built = False
+
+    def load(self):
+        """Load the build output, or the raw pages if there is no up-to-date build"""
+        manifest_path = os.path.join(self.dist_dir, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            changed = self._changed_sources(manifest)
+            if not changed:
+                for name, entry in manifest["pages"].items():
+                    self.pages[name] = self._load_built(entry, REVALIDATE)
+                for entry in manifest["assets"].values():
+                    self.assets[entry["file"]] = self._load_built(entry, IMMUTABLE)
+                self.built = True
+                print(f"Loaded {len(self.pages)} pages and {len(self.assets)} built assets into memory")
+                return
+            print(f"WARNING: {self.dist_dir} is out of date ({', '.join(changed[:5])}"
+                  f"{', ...' if len(changed) > 5 else ''}); serving the source files, "
+                  f"run build_assets.py to rebuild")
+        for name in ("wrapper.html", "index.html"):
+            path = os.path.join(self.static_dir, name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                self.pages[name] = Asset(
+                    content_type(name),
+                    {"identity": data, "gzip": gzip.compress(data, 9, mtime=0)},
+                    content_hash(data),
+                    REVALIDATE
+                )
+
+    def _changed_sources(self, manifest: Dict) -> List[str]:
+        """Source files whose content differs from what the build was made from"""
+        sources = manifest.get("sources")
+        if sources is None:
+            # Built before the sources were recorded
+            return ["sources not recorded"]
+        changed = []
+        for name, digest in sources.items():
+            path = os.path.join(self.static_dir, name)
+            if not os.path.exists(path):
+                changed.append(f"{name} removed")
+                continue
+            with open(path, "rb") as f:
+                if content_hash(f.read()) != digest:
+                    changed.append(f"{name} changed")
+        return changed
+
+    def _load_built(self, entry: Dict, cache_control: str) -> Asset:
+        bodies = {}
+        with open(os.path.join(self.dist_dir, entry["file"]), "rb") as f:
+            bodies["identity"] = f.read()
+        for coding, filename in entry.get("encodings", {}).items():
+            with open(os.path.join(self.dist_dir, filename), "rb") as f:
+                bodies[coding] = f.read()
+        return Asset(content_type(entry["file"]), bodies, entry["hash"], cache_control)
+
+    def page(self, name: str) -> Optional[Asset]:
+        return self.pages.get(name)
+
+    def asset(self, filename: str) -> Optional[Asset]:
+        return self.assets.get(filename)
@@ -1,7 +1,14 @@
 import numpy as np
-import asyncio
+import math
+import threading
 import time
-from typing import Dict, Optional, List, Callable, Any
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Optional, Any, Mapping, Tuple
+
+from acquisition import RingBuffer, Acquisition
+from dsp import BANDS, BandPowerEngine, SlidingDFT, FilterBank, design_sections
+from eeg_recorder import EEGRecorder
 
 # This is a mock of the Unicorn Python API for development/hackathon purposes
 # In a real implementation, you would use the actual Unicorn API
@@ -10,7 +17,10 @@ class MockUnicornAPI:
         self.connected = False
         self.data = None
         self.channels = 8
+        self.channel_names = ["Fz", "C3", "Cz", "C4", "Pz", "PO7", "Oz", "PO8"]
         self.sample_rate = 250
+        self._sample_index = 0
+        self._next_block = None
         
     def connect(self):
         """Mock connection to Unicorn device"""
@@ -24,13 +34,21 @@ class MockUnicornAPI:
         print("Mock Unicorn device disconnected")
         
     def get_data(self, samples):
-        """Generate mock EEG data"""
+        """Generate mock EEG data, blocking as long as the device takes to record it"""
+        now = time.monotonic()
+        if self._next_block is None or self._next_block < now - 1.0:
+            self._next_block = now
+        self._next_block += samples / self.sample_rate
+        time.sleep(max(self._next_block - now, 0))
+        
         # Create random data for demo purposes
         # In a real implementation, this would get actual EEG data
         data = np.random.normal(0, 10, (self.channels, samples))
         
         # Add some structured noise to simulate brain activity in different bands
-        t = np.arange(samples) / self.sample_rate
+        # (continuous across calls, like a real recording)
+        t = (self._sample_index + np.arange(samples)) / self.sample_rate
+        self._sample_index += samples
         
         # Alpha waves (8-13 Hz) - stronger when relaxed
         alpha = np.sin(2 * np.pi * 10 * t) * 5
@@ -55,24 +73,101 @@ class MockUnicornAPI:
 # For the hackathon, we'll use the mock API
 UnicornBlackAPI = MockUnicornAPI
 
+# Seconds without new samples after which reads fail
+STALE_AFTER = 2.0
+
+# Band power estimators BCIManager can use, see dsp.py
+SPECTRUM_ESTIMATORS = {
+    "fft": BandPowerEngine,
+    "sliding": SlidingDFT
+}
+
+@dataclass(frozen=True)
+class BCIFrame:
+    """
+    One analysis of the EEG stream, computed once and shared by every reader.
+
+    Args:
+        timestamp: Wall clock time of the analysis (time.time())
+        sample_index: Samples recorded since connecting, up to the end of the window
+        bandpowers: Power per band (read-only mapping)
+        focus_level: Smoothed focus level between 0 and 1
+        is_focused: focus_level reached the focus threshold
+        is_selecting: focus_level reached the selection threshold
+    """
+    timestamp: float
+    sample_index: int
+    bandpowers: Mapping[str, float]
+    focus_level: float
+    is_focused: bool
+    is_selecting: bool
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The frame as sent to clients"""
+        return {
+            'timestamp': self.timestamp,
+            'bandpowers': dict(self.bandpowers),
+            'focus_level': self.focus_level,
+            'is_focused': self.is_focused,
+            'is_selecting': self.is_selecting
+        }
+
 class BCIManager:
     """
     Manages the brain-computer interface connection and signal processing.
+
+    While connected, a thread streams the device through a mains notch and
+    band-pass filter into a ring buffer, and band powers are computed on the
+    last window_seconds of it, so they can be updated more often than once
+    per window.
+
+    Args:
+        window_seconds: Length of the analysed window
+        buffer_seconds: Samples kept in the ring buffer; must exceed the window
+            by more than the time one analysis takes
+        block_rate: Device reads per second
+        bands: Band name -> (low, high) in Hz; the focus level needs theta and beta
+        spectrum: "fft" to transform each window, or "sliding" to update the
+            band bins with each new block (cheaper at high frame rates)
+        notch_frequency: Mains frequency to filter out (50 Hz in Europe, 60 Hz in the USA); 0 to keep it
+        notch_harmonics: Also filter out the multiples of the mains frequency
+        band_pass: (low, high) edges in Hz of the band-pass filter, or None
+        focus_time_constant: Seconds over which the focus level is smoothed
+            (exponential moving average, independent of the frame rate)
     """
-    def __init__(self):
+    def __init__(self, window_seconds: float = 1.0, buffer_seconds: float = 4.0, block_rate: int = 25,
+                 bands: Dict[str, Tuple[float, float]] = BANDS, spectrum: str = "fft",
+                 notch_frequency: float = 50.0, notch_harmonics: bool = False,
+                 band_pass: Optional[Tuple[float, float]] = (0.5, 60.0),
+                 focus_time_constant: float = 1.0):
         self.unicorn = UnicornBlackAPI()
+        sample_rate = self.unicorn.sample_rate
+        self.window_samples = int(window_seconds * sample_rate)
+        self.buffer = RingBuffer(self.unicorn.channels, int(buffer_seconds * sample_rate))
+        if spectrum not in SPECTRUM_ESTIMATORS:
+            raise ValueError(f"Unknown spectrum estimator {spectrum!r}, expected one of {list(SPECTRUM_ESTIMATORS)}")
+        self.engine = SPECTRUM_ESTIMATORS[spectrum](self.unicorn.channels, self.window_samples, sample_rate, bands)
+        self.filter = FilterBank(self.unicorn.channels, design_sections(
+            sample_rate, notch_frequency, harmonics=notch_harmonics, band=band_pass))
+        self.acquisition = Acquisition(self.unicorn, self.buffer, max(sample_rate // block_rate, 1), self.filter)
         self.connected = False
         self.focus_threshold = 0.65
         self.selection_threshold = 0.75
-        self.last_bandpowers = None
-        self.focus_history = []
-        self.max_history = 10
+        self.focus_time_constant = focus_time_constant
+        self.smoothed_focus: Optional[float] = None
+        self.latest_frame: Optional[BCIFrame] = None
+        self._last_frame_time: Optional[float] = None
+        self.recorder: Optional[EEGRecorder] = None
+        # Frames are made on the "bci-dsp" thread; disconnect() resets their state on the loop
+        self._frame_lock = threading.Lock()
         
     def connect(self) -> bool:
         """Connect to the Unicorn Hybrid Black device"""
         try:
             success = self.unicorn.connect()
             self.connected = success
+            if success:
+                self.acquisition.start()
             return success
         except Exception as e:
             print(f"Failed to connect to Unicorn device: {e}")
@@ -81,129 +176,135 @@ class BCIManager:
     def disconnect(self) -> bool:
         """Disconnect from the Unicorn device"""
         if self.connected:
+            with self._frame_lock:
+                # No frame is made after this; the next session starts its own smoothing
+                self.connected = False
+                self.latest_frame = None
+                self.smoothed_focus = None
+                self._last_frame_time = None
+            self.acquisition.stop()
+            self.stop_recording()
             self.unicorn.disconnect()
-            self.connected = False
             return True
         return False
     
+    def start_recording(self, path: str, max_seconds: float = 3600.0) -> EEGRecorder:
+        """
+        Record the raw samples of the device to a file (see eeg_recorder).
+
+        Args:
+            path: File to create
+            max_seconds: Length of the preallocated file
+        """
+        if not self.connected:
+            raise ValueError("The BCI device is not connected")
+        if self.recorder is not None:
+            raise ValueError(f"Already recording to {self.recorder.path}")
+        recorder = EEGRecorder(path, self.unicorn.channel_names, self.unicorn.sample_rate, max_seconds)
+        recorder.start()
+        self.recorder = self.acquisition.recorder = recorder
+        return recorder
+
+    def stop_recording(self) -> Optional[EEGRecorder]:
+        """Finish the recording, if any, and return it"""
+        recorder = self.recorder
+        if recorder is not None:
+            self.recorder = self.acquisition.recorder = None
+            recorder.stop()
+        return recorder
+
     def get_bandpowers(self) -> Optional[Dict[str, float]]:
         """
         Get the current bandpower values from the device.
-        Returns a dictionary with delta, theta, alpha, beta, gamma bands.
+        Returns a dictionary with delta, theta, alpha, beta, gamma bands,
+        or None until the first frame. Reads the latest frame; see read_frame().
         """
-        if not self.connected:
-            return None
-            
-        # Get raw EEG data from the device
-        # 1 second of data at 250 Hz sampling rate
-        try:
-            eeg_data = self.unicorn.get_data(250)  
-            
-            # Calculate band powers using FFT (simplified for hackathon)
-            bandpowers = {
-                'delta': float(np.mean(self._extract_band(eeg_data, 1, 4))),
-                'theta': float(np.mean(self._extract_band(eeg_data, 4, 8))),
-                'alpha': float(np.mean(self._extract_band(eeg_data, 8, 13))),
-                'beta': float(np.mean(self._extract_band(eeg_data, 13, 30))),
-                'gamma': float(np.mean(self._extract_band(eeg_data, 30, 50)))
-            }
-            
-            self.last_bandpowers = bandpowers
-            return bandpowers
-        except Exception as e:
-            print(f"Error getting bandpowers: {e}")
+        if not self.connected or self.latest_frame is None:
             return None
+        return dict(self.latest_frame.bandpowers)
     
-    def _extract_band(self, data: np.ndarray, low_freq: float, high_freq: float) -> np.ndarray:
-        """
-        Extract frequency band from EEG data using FFT.
-        This is a simplified version for the hackathon.
-        
-        Args:
-            data: Raw EEG data, shape (channels, samples)
-            low_freq: Lower frequency bound
-            high_freq: Upper frequency bound
-            
-        Returns:
-            Band power for each channel
-        """
-        # In a real implementation, you would use proper signal processing
-        # with windowing, overlapping, etc.
-        
-        # For the hackathon, simulate frequency content
-        channels, samples = data.shape
-        freqs = np.fft.rfftfreq(samples, 1.0/self.unicorn.sample_rate)
-        
-        # FFT for each channel
-        ffts = np.abs(np.fft.rfft(data, axis=1))**2
-        
-        # Extract the specified band
-        band_mask = (freqs >= low_freq) & (freqs <= high_freq)
-        
-        # Mean power in the band for each channel
-        band_powers = np.mean(ffts[:, band_mask], axis=1)
-        
-        return band_powers
+    def is_stalled(self) -> bool:
+        """The device delivered samples before but none for STALE_AFTER seconds"""
+        return bool(self.buffer.total) and time.monotonic() - self.buffer.updated > STALE_AFTER
     
-    def get_focus_level(self) -> float:
+    def _read_bandpowers(self) -> Optional[Dict[str, float]]:
+        """Band powers of the latest window; None before it is full, raises when the device stalls"""
+        if self.is_stalled():
+            raise RuntimeError(f"No EEG samples for {STALE_AFTER:.0f} s")
+        # Last second of data at 250 Hz sampling rate, read from the buffer without copying
+        powers = self.engine.compute_latest(self.buffer)
+        if powers is None:
+            return None
+        return dict(zip(self.engine.names, powers.tolist()))
+    
+    def _smooth_focus(self, bandpowers: Dict[str, float], now: float) -> float:
         """
-        Calculate focus level based on EEG data.
+        Calculate focus level based on EEG data and fold it into the moving average.
         Returns a value between 0 and 1.
         """
-        if not self.last_bandpowers:
-            self.get_bandpowers()
-            
-        if not self.last_bandpowers:
-            return 0.0
-        
         # Calculate focus level based on beta/theta ratio
         # High beta and low theta indicates focus/concentration
-        bp = self.last_bandpowers
+        bp = bandpowers
         focus = bp['beta'] / (bp['theta'] + 0.01)  # Avoid division by zero
         
         # Normalize to 0-1 range with sigmoid function
-        normalized_focus = 1.0 / (1.0 + np.exp(-0.5 * (focus - 5.0)))
-        
-        # Add to history for smoothing
-        self.focus_history.append(normalized_focus)
-        if len(self.focus_history) > self.max_history:
-            self.focus_history.pop(0)
+        normalized_focus = 1.0 / (1.0 + math.exp(-0.5 * (focus - 5.0)))
         
-        # Return smoothed value
-        smoothed_focus = float(np.mean(self.focus_history))
-        return smoothed_focus
+        # Exponential moving average weighted by the time since the last frame,
+        # so the smoothing does not depend on how often frames are computed
+        if self.smoothed_focus is None or self._last_frame_time is None:
+            self.smoothed_focus = normalized_focus
+        else:
+            weight = 1.0 - math.exp(-(now - self._last_frame_time) / self.focus_time_constant)
+            self.smoothed_focus += weight * (normalized_focus - self.smoothed_focus)
+        self._last_frame_time = now
+        return self.smoothed_focus
+    
+    def get_focus_level(self) -> float:
+        """Smoothed focus level of the latest frame, between 0 and 1"""
+        if self.latest_frame is None:
+            return 0.0
+        return self.latest_frame.focus_level
     
     def is_focused(self) -> bool:
         """Check if the user is currently focused based on EEG data"""
-        focus_level = self.get_focus_level()
-        return focus_level >= self.focus_threshold
+        return self.latest_frame is not None and self.latest_frame.is_focused
     
     def is_making_selection(self) -> bool:
         """
         Check if the user is making a selection action.
         This could be a strong focus spike or a specific pattern.
         """
-        focus_level = self.get_focus_level()
+        # For selection, we want a higher threshold (see read_frame)
+        return self.latest_frame is not None and self.latest_frame.is_selecting
         
-        # For selection, we want a higher threshold
-        return focus_level >= self.selection_threshold
-        
-    async def continuous_monitoring(self, callback: Callable[[Dict[str, Any]], Any]):
+    def read_frame(self) -> Optional[BCIFrame]:
+        """
+        Analyse the latest window once: band powers, the smoothed focus level
+        and the flags derived from it. The frame becomes latest_frame, which
+        every other reader returns. None until a full window has been
+        recorded; raises when the device stops delivering samples.
+        """
+        bandpowers = self._read_bandpowers()
+        if bandpowers is None:
+            return None
+        return self.make_frame(bandpowers)
+    
+    def make_frame(self, bandpowers: Dict[str, float]) -> Optional[BCIFrame]:
         """
-        Continuously monitor BCI data and call the callback 
-        when important events happen.
+        Build the frame for band powers computed from this device's latest
+        window; None if the device was disconnected in the meantime.
         """
-        while self.connected:
-            bandpowers = self.get_bandpowers()
-            focus_level = self.get_focus_level()
-            is_focused = self.is_focused()
-            is_selecting = self.is_making_selection()
-            
-            await callback({
-                'bandpowers': bandpowers,
-                'focus_level': focus_level,
-                'is_focused': is_focused,
-                'is_selecting': is_selecting
-            })
-            
-            await asyncio.sleep(0.2)  # 5 updates per second
\ No newline at end of file
+        with self._frame_lock:
+            if not self.connected:
+                return None
+            focus_level = self._smooth_focus(bandpowers, time.monotonic())
+            self.latest_frame = BCIFrame(
+                timestamp=time.time(),
+                sample_index=self.buffer.total,
+                bandpowers=MappingProxyType(bandpowers),
+                focus_level=focus_level,
+                is_focused=focus_level >= self.focus_threshold,
+                is_selecting=focus_level >= self.selection_threshold
+            )
+            return self.latest_frame
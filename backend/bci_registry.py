@@ -0,0 +1,235 @@
+"""
+Several BCI headsets served at once.
+
+BCIRegistry holds one BCIManager per device id, each with its own
+acquisition thread, filter and ring buffer. A single "bci-dsp" thread
+analyses all of them on every tick: the latest windows of the connected
+headsets go through one batched FFT and band reduction
+(dsp.BandPowerEngine.compute_batch), then each device smooths its own focus
+level into its BCIFrame. Frames are handed to the event loop with
+call_soon_threadsafe, and BCIProducer publishes each one on its device's
+topic.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from bci_manager import BCIManager, BCIFrame
+from dsp import BandPowerEngine
+from metrics import BCI_TICK_SECONDS, BCI_TICK_JITTER_SECONDS, BCI_PRODUCER_RESTARTS
+
+class BCIRegistry:
+    """
+    The headsets of this worker, by device id.
+
+    Args:
+        max_devices: Devices kept at once; disconnected ones make room for new ones
+        **device_options: Passed to every BCIManager (window, filters, spectrum...)
+    """
+    def __init__(self, max_devices: int = 8, **device_options: Any):
+        self.max_devices = max_devices
+        self.device_options = device_options
+        self.devices: Dict[str, BCIManager] = {}
+        self.stalled: Dict[str, bool] = {}
+
+    def get(self, device_id: str) -> BCIManager:
+        """The device with this id, created on first use"""
+        device = self.devices.get(device_id)
+        if device is None:
+            if len(self.devices) >= self.max_devices:
+                # Make room by forgetting a disconnected device
+                idle = next((other for other, known in self.devices.items() if not known.connected), None)
+                if idle is None:
+                    raise ValueError(f"At most {self.max_devices} BCI devices can be connected")
+                del self.devices[idle]
+                self.stalled.pop(idle, None)
+            device = self.devices[device_id] = BCIManager(**self.device_options)
+        return device
+
+    def connected_devices(self) -> Dict[str, BCIManager]:
+        return {device_id: device for device_id, device in list(self.devices.items()) if device.connected}
+
+    def disconnect_all(self):
+        for device in self.devices.values():
+            if device.connected:
+                device.disconnect()
+
+    def read_frames(self) -> Dict[str, BCIFrame]:
+        """
+        Analyse the latest window of every connected device. Devices without
+        a full window yet or that stopped delivering samples are left out.
+        """
+        batched: List[tuple] = []
+        frames = {}
+        for device_id, device in self.connected_devices().items():
+            stalled = device.is_stalled()
+            if stalled != self.stalled.get(device_id, False):
+                print(f"BCI device {device_id} {'stopped' if stalled else 'resumed'} delivering samples")
+                self.stalled[device_id] = stalled
+            if stalled:
+                continue
+            if type(device.engine) is BandPowerEngine:
+                window = device.buffer.latest(device.window_samples)
+                if window is not None:
+                    batched.append((device_id, device, window))
+            else:
+                # Incremental estimators keep state per device
+                frame = device.read_frame()
+                if frame is not None:
+                    frames[device_id] = frame
+
+        if batched:
+            # All devices share the options, so any of their engines fits every window
+            engine = batched[0][1].engine
+            powers = engine.compute_batch([window for _, _, window in batched])
+            for (device_id, device, _), row in zip(batched, powers.tolist()):
+                frame = device.make_frame(dict(zip(engine.names, row)))
+                if frame is not None:
+                    frames[device_id] = frame
+        return frames
+
+    async def continuous_monitoring(self, callback: Callable[[Dict[str, BCIFrame]], Any], interval: float = 0.2):
+        """
+        Analyse all devices every interval on a "bci-dsp" thread and await
+        callback with the frames of each tick on the loop.
+
+        Ticks are handed to the loop with call_soon_threadsafe; if the
+        callback falls behind, only the newest tick is kept. Returns when no
+        device is connected any more and raises what the analysis raised.
+
+        Args:
+            callback: Coroutine function receiving the frames of a tick by device id
+            interval: Seconds between ticks (0.2 = 5 updates per second)
+        """
+        loop = asyncio.get_running_loop()
+        ticks: asyncio.Queue = asyncio.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def hand_over(item):
+            # Runs on the loop: frames, the exception that ended the thread, or None at the end
+            if ticks.full():
+                ticks.get_nowait()
+            ticks.put_nowait(item)
+
+        def observe_tick(seconds, jitter):
+            # Runs on the loop: metrics are only updated there (see metrics.py)
+            BCI_TICK_SECONDS.observe(seconds)
+            if jitter is not None:
+                BCI_TICK_JITTER_SECONDS.observe(jitter)
+
+        def analyse():
+            item = None
+            last_tick = None
+            next_tick = time.perf_counter()
+            try:
+                while self.connected_devices() and not stop.is_set():
+                    tick_start = time.perf_counter()
+                    jitter = None if last_tick is None else abs(tick_start - last_tick - interval)
+                    last_tick = tick_start
+
+                    frames = self.read_frames()
+                    loop.call_soon_threadsafe(hand_over, frames)
+                    loop.call_soon_threadsafe(observe_tick, time.perf_counter() - tick_start, jitter)
+
+                    # Keep the tick rate; after an overrun, start again from now
+                    next_tick = max(next_tick + interval, time.perf_counter())
+                    stop.wait(next_tick - time.perf_counter())
+            except Exception as e:
+                item = e
+            try:
+                loop.call_soon_threadsafe(hand_over, item)
+            except RuntimeError:
+                pass  # The loop is closed
+
+        thread = threading.Thread(target=analyse, name="bci-dsp", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = await ticks.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                await callback(item)
+        finally:
+            stop.set()
+
+    def memory_stats(self) -> Dict[str, Any]:
+        return {
+            "devices": len(self.devices),
+            "connected": len(self.connected_devices()),
+            "ring_buffer_bytes": sum(device.buffer.data.nbytes for device in self.devices.values())
+        }
+
+class BCIProducer:
+    """
+    The single loop that reads frames from all devices of a registry.
+
+    Every frame is computed once, kept as the device's snapshot that
+    /bci/status returns and passed to publish, which fans it out to the
+    device's subscribers. When the loop fails it is restarted with
+    exponential backoff; it ends when the last device disconnects.
+
+    Args:
+        registry: Devices to read
+        publish: Coroutine function receiving (device id, BCIFrame)
+        interval: Seconds between frames
+        min_backoff: First restart delay in seconds, doubled on each failure
+        max_backoff: Longest restart delay; a run lasting this long resets the delay
+    """
+    def __init__(self, registry: BCIRegistry, publish: Callable[[str, BCIFrame], Any],
+                 interval: float = 0.2, min_backoff: float = 0.5, max_backoff: float = 10.0):
+        self.registry = registry
+        self.publish = publish
+        self.interval = interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.latest: Dict[str, BCIFrame] = {}
+        self.restarts = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the loop unless it is already running"""
+        if not self.running:
+            self._task = asyncio.create_task(self._supervise())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.latest = {}
+
+    async def _on_frames(self, frames: Dict[str, BCIFrame]):
+        # Devices missing from a tick (stalled, disconnected) have no current frame,
+        # nor do those disconnected since the tick was computed
+        devices = self.registry.devices
+        frames = {device_id: frame for device_id, frame in frames.items()
+                  if device_id in devices and devices[device_id].connected}
+        self.latest = frames
+        for device_id, frame in frames.items():
+            await self.publish(device_id, frame)
+
+    async def _supervise(self):
+        backoff = self.min_backoff
+        try:
+            while self.registry.connected_devices():
+                started = time.monotonic()
+                try:
+                    await self.registry.continuous_monitoring(self._on_frames, interval=self.interval)
+                except Exception as e:
+                    if time.monotonic() - started >= self.max_backoff:
+                        backoff = self.min_backoff
+                    self.latest = {}
+                    self.restarts += 1
+                    BCI_PRODUCER_RESTARTS.inc()
+                    print(f"BCI producer failed: {e!r}, restarting in {backoff:.1f}s")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            # No stale values once the devices are gone
+            self.latest = {}
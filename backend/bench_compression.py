@@ -0,0 +1,100 @@
+"""
+Benchmark permessage-deflate settings on the server's real message types.
+
+Encodes a stream of game_state and bci_data messages through the same
+extension the server negotiates and reports the compression ratio and the
+CPU time per message, so the bandwidth/CPU trade-off of each setting can be
+compared. Run with: python bench_compression.py [--messages N]
+"""
+import argparse
+import json
+import random
+import time
+
+from websockets.frames import Frame, Opcode
+
+from chess_logic import ChessGame
+from compression import CompressionSettings, ThresholdPerMessageDeflate
+
+CONFIGURATIONS = {
+    "context takeover, 12 bits, level 6": CompressionSettings(),
+    "context takeover, 15 bits, level 6": CompressionSettings(server_max_window_bits=15),
+    "context takeover, 12 bits, level 1": CompressionSettings(level=1),
+    "no context takeover, 12 bits, level 6": CompressionSettings(server_no_context_takeover=True),
+    "no context takeover, 9 bits, level 1": CompressionSettings(
+        server_no_context_takeover=True, server_max_window_bits=9, level=1),
+}
+
+def game_state_messages(count):
+    """State broadcasts from a game of random legal moves"""
+    random.seed(1)
+    game = ChessGame()
+    messages = []
+    while len(messages) < count:
+        if game.checkmate or game.stalemate:
+            game = ChessGame()
+        moves = [
+            (row, col, move)
+            for row in range(8) for col in range(8)
+            for move in game.get_valid_moves(row, col)
+        ]
+        row, col, move = random.choice(moves)
+        game.make_move(row, col, move["row"], move["col"])
+        messages.append(json.dumps({"type": "game_state", "state": game.get_state(), "topic": "game:default"}))
+    return messages
+
+def bci_messages(count):
+    """BCI frames with random bandpowers"""
+    random.seed(2)
+    return [
+        json.dumps({
+            "type": "bci_data",
+            "data": {
+                "bandpowers": {band: random.uniform(0, 5000) for band in ("delta", "theta", "alpha", "beta", "gamma")},
+                "focus_level": random.random(),
+                "is_focused": random.random() > 0.5,
+                "is_selecting": random.random() > 0.8
+            },
+            "topic": "bci:default"
+        })
+        for _ in range(count)
+    ]
+
+def run(settings, messages):
+    """Compress a message stream on one connection; returns (raw bytes, sent bytes, seconds)"""
+    extension = ThresholdPerMessageDeflate(
+        False,
+        settings.server_no_context_takeover,
+        settings.client_max_window_bits,
+        settings.server_max_window_bits,
+        {"level": settings.level, "memLevel": settings.mem_level},
+        min_size=settings.min_size
+    )
+    frames = [Frame(Opcode.TEXT, message.encode()) for message in messages]
+    raw = sum(len(frame.data) for frame in frames)
+    start = time.perf_counter()
+    sent = sum(len(extension.encode(frame).data) for frame in frames)
+    return raw, sent, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500, help="messages per stream")
+    args = parser.parse_args()
+
+    streams = {
+        "game_state": game_state_messages(args.messages),
+        "bci_data": bci_messages(args.messages),
+    }
+    for name, messages in streams.items():
+        average = sum(len(message) for message in messages) / len(messages)
+        print(f"\n{name}: {len(messages)} messages, {average:.0f} bytes on average")
+        print(f"  {'setting':<40} {'ratio':>7} {'bytes/msg':>10} {'us/msg':>8}")
+        for label, settings in CONFIGURATIONS.items():
+            # Compress everything here; the threshold is a separate decision
+            settings.min_size = 0
+            raw, sent, seconds = run(settings, messages)
+            print(f"  {label:<40} {raw / sent:>7.2f} {sent / len(messages):>10.0f} "
+                  f"{seconds / len(messages) * 1e6:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Game state and broadcast backends.
+
+LocalBackend keeps the games in this process, which is all a single uvicorn
+worker needs. To serve clients from several workers on one host, start one
+hub and point every worker at its Unix domain socket:
+
+    python broker.py --socket /tmp/chess_broker.sock
+    CHESS_BROKER_SOCKET=/tmp/chess_broker.sock uvicorn main:app --workers 4
+
+The hub owns the games. Workers forward game commands to it and keep a
+replica of each game's encoded state, so reads never leave the worker. Every
+publish (game states, BCI frames) reaches the sockets held by all workers.
+Messages are newline-delimited JSON over the Unix socket.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import secrets
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from chess_logic import ChessGame
+from diagnostics import deep_sizeof
+from metrics import ENGINE_SECONDS, record_timing
+from websocket_manager import ConnectionManager, game_topic
+
+# Environment variable naming the hub's socket; unset means single-process mode
+BROKER_SOCKET_ENV = "CHESS_BROKER_SOCKET"
+
+# Large enough for a game state embedded in a JSON line
+STREAM_LIMIT = 1 << 20
+
+# Seconds between attempts to reconnect a worker to the hub, doubled up to the maximum
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10.0
+
+# Game versions restart from 0 with the process that owns the games, so
+# clients see them qualified by this per-boot id (see Backend.etag)
+BOOT_ID = secrets.token_hex(4)
+
+def apply_command(game: ChessGame, method: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a game command; shared by the local backend and the hub"""
+    if method == "move":
+        success, message = game.make_move(
+            args["from_row"], args["from_col"], args["to_row"], args["to_col"], args.get("promotion"))
+        return {"success": success, "message": message}
+    if method == "legal_moves":
+        return {"success": True, "moves": game.get_valid_moves(args["row"], args["col"])}
+    if method == "new_game":
+        game.new_game()
+        return {"success": True, "message": "New game started"}
+    if method == "undo":
+        success, message = game.undo_move()
+        return {"success": success, "message": message}
+    raise ValueError(f"Unknown game command: {method}")
+
+class Backend(ABC):
+    """
+    Common interface of the game/broadcast backends.
+
+    Reads (version, state_json, state_binary, state_message) are synchronous
+    and served from memory. Commands are coroutines; when they change a game
+    the new state is published on its topic, optionally skipping the client
+    that already gets it in a command response.
+    """
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        self._messages: Dict[str, Tuple[int, str]] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @property
+    def connected(self) -> bool:
+        """False while commands cannot be served (the worker is not ready)"""
+        return True
+
+    @abstractmethod
+    def version(self, game_id: str) -> int:
+        ...
+
+    @abstractmethod
+    def state_json(self, game_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def state_binary(self, game_id: str) -> bytes:
+        ...
+
+    @abstractmethod
+    async def command(self, game_id: str, method: str, args: Dict[str, Any],
+                      exclude=None) -> Dict[str, Any]:
+        ...
+
+    def epoch(self, game_id: str) -> str:
+        """Boot id of the process owning the game"""
+        return BOOT_ID
+
+    def etag(self, game_id: str) -> str:
+        """HTTP validator of a game's state, unique across restarts of its owner"""
+        return f'"{self.epoch(game_id)}-{self.version(game_id)}"'
+
+    def state_message(self, game_id: str) -> str:
+        """The game_state message for a game's topic, encoded once per version"""
+        version = self.version(game_id)
+        cached = self._messages.get(game_id)
+        if cached is None or cached[0] != version:
+            topic = json.dumps(game_topic(game_id))
+            cached = (version, f'{{"type":"game_state","topic":{topic},"state":{self.state_json(game_id)}}}')
+            self._messages[game_id] = cached
+        return cached[1]
+
+    def memory_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-game sizes of the state this process holds"""
+        return {}
+
+    async def valid_moves(self, game_id: str, row: int, col: int) -> List[Dict[str, Any]]:
+        result = await self.command(game_id, "legal_moves", {"row": row, "col": col})
+        return result["moves"]
+
+    async def make_move(self, game_id: str, move: Dict[str, Any], exclude=None) -> Tuple[bool, str]:
+        result = await self.command(game_id, "move", move, exclude)
+        return result["success"], result["message"]
+
+    async def new_game(self, game_id: str, exclude=None):
+        await self.command(game_id, "new_game", {}, exclude)
+
+    async def undo(self, game_id: str, exclude=None) -> Tuple[bool, str]:
+        result = await self.command(game_id, "undo", {}, exclude)
+        return result["success"], result["message"]
+
+    async def publish(self, topic: str, message: Dict[str, Any]):
+        """Publish a message to the topic's subscribers on every worker"""
+        await self.publish_encoded(topic, json.dumps({**message, "topic": topic}))
+
+    async def publish_encoded(self, topic: str, text: str, exclude=None):
+        await self.manager.publish_encoded(topic, text, exclude)
+
+class LocalBackend(Backend):
+    """Games and broadcasts in this process only (single worker)"""
+    def __init__(self, manager: ConnectionManager):
+        super().__init__(manager)
+        self.games: Dict[str, ChessGame] = {}
+
+    def game(self, game_id: str) -> ChessGame:
+        """The game with this id, created on first use"""
+        game = self.games.get(game_id)
+        if game is None:
+            game = self.games[game_id] = ChessGame()
+        return game
+
+    def version(self, game_id: str) -> int:
+        return self.game(game_id).version
+
+    def memory_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            game_id: {
+                "moves": len(game.move_history),
+                "undo_positions": len(game.undo_stack),
+                "bytes": deep_sizeof(game)
+            }
+            for game_id, game in self.games.items()
+        }
+
+    def state_json(self, game_id: str) -> str:
+        return self.game(game_id).get_state_json()
+
+    def state_binary(self, game_id: str) -> bytes:
+        return self.game(game_id).get_state_binary()
+
+    async def command(self, game_id: str, method: str, args: Dict[str, Any],
+                      exclude=None) -> Dict[str, Any]:
+        game = self.game(game_id)
+        version = game.version
+        start = time.perf_counter()
+        result = apply_command(game, method, args)
+        elapsed = time.perf_counter() - start
+        ENGINE_SECONDS.labels(method).observe(elapsed)
+        record_timing("engine", elapsed)
+        if game.version != version:
+            await self.manager.publish_encoded(game_topic(game_id), self.state_message(game_id), exclude)
+        return result
+
+class GameReplica:
+    """A worker's copy of one game's encoded state"""
+    def __init__(self, version: int, state_json: str, state_binary: bytes, epoch: str = ""):
+        self.version = version
+        self.epoch = epoch
+        self.state_json = state_json
+        self.state_binary = state_binary
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> "GameReplica":
+        return cls(message["version"], message["json"], base64.b64decode(message["binary"]),
+                   message.get("epoch", ""))
+
+class BrokerBackend(Backend):
+    """Worker side of the hub: forwards commands and relays publishes"""
+    def __init__(self, manager: ConnectionManager, path: str):
+        super().__init__(manager)
+        self.path = path
+        self.replicas: Dict[str, GameReplica] = {}
+        self._ids = itertools.count(1)
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._stopping = False
+
+    async def start(self):
+        await self._connect()
+        self._task = asyncio.create_task(self._run())
+        # The hub sends the state of every game right after connecting
+        await self._ready.wait()
+        print(f"Connected to game broker at {self.path}")
+
+    @property
+    def connected(self) -> bool:
+        return self._ready.is_set() and self._writer is not None and not self._writer.is_closing()
+
+    async def _connect(self):
+        self._ready.clear()
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=STREAM_LIMIT)
+
+    async def _run(self):
+        """Read from the hub, reconnecting with exponential backoff when the connection is lost"""
+        while True:
+            try:
+                await self._read_loop()
+            except Exception as e:
+                print(f"Game broker connection failed: {e!r}")
+            if self._stopping:
+                return
+            backoff = RECONNECT_MIN_DELAY
+            while True:
+                await asyncio.sleep(backoff)
+                try:
+                    await self._connect()
+                    break
+                except OSError as e:
+                    backoff = min(backoff * 2, RECONNECT_MAX_DELAY)
+                    print(f"Reconnecting to the game broker failed: {e}, retrying in {backoff:.1f}s")
+            print(f"Reconnected to game broker at {self.path}")
+
+    async def stop(self):
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    def _send(self, message: Dict[str, Any]):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError("Not connected to the game broker")
+        self._writer.write(json.dumps(message).encode() + b"\n")
+
+    def version(self, game_id: str) -> int:
+        return self.replicas[game_id].version
+
+    def epoch(self, game_id: str) -> str:
+        return self.replicas[game_id].epoch
+
+    def memory_stats(self) -> Dict[str, Dict[str, Any]]:
+        # The games themselves live in the hub; workers only hold encoded replicas
+        return {game_id: {"bytes": deep_sizeof(replica)} for game_id, replica in self.replicas.items()}
+
+    def _apply(self, game_id: str, message: Dict[str, Any]) -> bool:
+        """Keep a state sent by the hub unless a newer one arrived first; True if it was kept"""
+        current = self.replicas.get(game_id)
+        # Until "ready", the hub is sending its current games after a (re)connect,
+        # which replace the replicas even if it restarted with lower versions
+        if current is not None and self._ready.is_set() and message["version"] <= current.version:
+            return False
+        self.replicas[game_id] = GameReplica.from_message(message)
+        return True
+
+    def state_json(self, game_id: str) -> str:
+        return self.replicas[game_id].state_json
+
+    def state_binary(self, game_id: str) -> bytes:
+        return self.replicas[game_id].state_binary
+
+    async def command(self, game_id: str, method: str, args: Dict[str, Any],
+                      exclude=None) -> Dict[str, Any]:
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        start = time.perf_counter()
+        try:
+            self._send({"op": "call", "id": call_id, "game": game_id, "method": method, "args": args})
+            reply = await future
+        finally:
+            self._calls.pop(call_id, None)
+        # Includes the round trip to the hub, which runs the engine
+        elapsed = time.perf_counter() - start
+        ENGINE_SECONDS.labels(method).observe(elapsed)
+        record_timing("engine", elapsed)
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        if "state" in reply and self._apply(game_id, reply["state"]):
+            # The hub sends the new state to the other workers; publish it here.
+            # Skipped when a later broadcast already overtook the reply.
+            await self.manager.publish_encoded(game_topic(game_id), self.state_message(game_id), exclude)
+        return reply["result"]
+
+    async def publish_encoded(self, topic: str, text: str, exclude=None):
+        await self.manager.publish_encoded(topic, text, exclude)
+        self._send({"op": "publish", "topic": topic, "text": text})
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message["op"]
+                if op == "reply":
+                    future = self._calls.get(message["id"])
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                elif op == "state":
+                    if self._apply(message["game"], message):
+                        await self.manager.publish_encoded(
+                            game_topic(message["game"]), self.state_message(message["game"]))
+                elif op == "publish":
+                    await self.manager.publish_encoded(message["topic"], message["text"])
+                elif op == "ready":
+                    self._ready.set()
+        finally:
+            self._ready.clear()
+            if not self._stopping:
+                print("Lost connection to the game broker")
+            for future in self._calls.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost connection to the game broker"))
+            if self._writer is not None:
+                self._writer.close()
+
+class BrokerHub:
+    """
+    Single-host hub owning the games and fanning out publishes between workers.
+
+    Args:
+        path: Filesystem path of the Unix domain socket to listen on
+        game_ids: Games that exist from the start
+    """
+    def __init__(self, path: str, game_ids: Tuple[str, ...] = ("default",)):
+        self.path = path
+        self.games: Dict[str, ChessGame] = {game_id: ChessGame() for game_id in game_ids}
+        self.workers: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @staticmethod
+    def _state(game_id: str, game: ChessGame) -> Dict[str, Any]:
+        return {
+            "op": "state",
+            "game": game_id,
+            "version": game.version,
+            "epoch": BOOT_ID,
+            "json": game.get_state_json(),
+            "binary": base64.b64encode(game.get_state_binary()).decode()
+        }
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+        if not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b"\n")
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_worker, self.path, limit=STREAM_LIMIT)
+        print(f"Game broker listening on {self.path}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.workers.add(writer)
+        for game_id, game in self.games.items():
+            self._write(writer, self._state(game_id, game))
+        self._write(writer, {"op": "ready"})
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message["op"] == "publish":
+                    for other in self.workers:
+                        if other is not writer:
+                            self._write(other, message)
+                elif message["op"] == "call":
+                    self._call(writer, message)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.workers.discard(writer)
+            writer.close()
+
+    def _call(self, writer: asyncio.StreamWriter, message: Dict[str, Any]):
+        game_id = message["game"]
+        game = self.games.get(game_id)
+        if game is None:
+            game = self.games[game_id] = ChessGame()
+        version = game.version
+        try:
+            result = apply_command(game, message["method"], message["args"])
+        except (KeyError, TypeError, ValueError) as e:
+            self._write(writer, {"op": "reply", "id": message["id"], "error": str(e)})
+            return
+        except Exception as e:
+            # A failing command must not end the worker's session
+            print(f"Broker command {message.get('method')} failed: {e!r}")
+            self._write(writer, {"op": "reply", "id": message["id"], "error": f"Command failed: {e}"})
+            return
+
+        reply = {"op": "reply", "id": message["id"], "result": result}
+        if game.version != version:
+            state = self._state(game_id, game)
+            reply["state"] = state
+            for other in self.workers:
+                if other is not writer:
+                    self._write(other, state)
+        self._write(writer, reply)
+
+def create_backend(manager: ConnectionManager) -> Backend:
+    """The hub-backed backend if CHESS_BROKER_SOCKET is set, else the local one"""
+    path = os.environ.get(BROKER_SOCKET_ENV)
+    if path:
+        return BrokerBackend(manager, path)
+    return LocalBackend(manager)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the game broker hub for multi-worker deployments")
+    parser.add_argument("--socket", default=os.environ.get(BROKER_SOCKET_ENV, "/tmp/chess_broker.sock"),
+                        help="Unix domain socket path")
+    args = parser.parse_args()
+    hub = BrokerHub(args.socket)
+    try:
+        asyncio.run(hub.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hub.close()
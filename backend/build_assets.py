@@ -0,0 +1,191 @@
+"""
+Build the frontend assets for production.
+
+Writes static/dist/ with:
+- content-hashed copies of adapter.js and the images (name.<hash>.ext)
+- gzip (and brotli, if the brotli package is installed) variants of text files
+- a sprite sheet of the UI images, scaled to twice their display size
+  (needs Pillow; without it the images are only fingerprinted)
+- wrapper.html and index.html rewritten to use the hashed URLs, with the
+  asset map injected as window.ASSETS
+- manifest.json, read by assets.AssetStore at startup, with the content hash
+  of every source file so that a build older than its sources is not served
+
+Run with: python build_assets.py (then restart the server)
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+from io import BytesIO
+from typing import Dict, Any, Optional, Tuple
+
+from assets import content_hash
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATIC_DIR = "static"
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+URL_PREFIX = "/assets/"
+PAGES = ("wrapper.html", "index.html")
+SCRIPTS = ("adapter.js",)
+COMPRESSIBLE = (".html", ".js", ".css", ".json", ".svg")
+
+# Display size (CSS pixels) of each UI image; the sprite holds them at SPRITE_SCALE x
+SPRITE_SCALE = 2
+ARROW_SIZE = (90, 90)
+BUTTON_SIZE = (150, 60)
+SPRITES = {
+    "Green arrow up": ARROW_SIZE,
+    "black arrow up-right": ARROW_SIZE,
+    "blue arrow left": ARROW_SIZE,
+    "pink arrow down-left": ARROW_SIZE,
+    "purple arrow down-right": ARROW_SIZE,
+    "red arrow right": ARROW_SIZE,
+    "white arrow up-left": ARROW_SIZE,
+    "yellow arrow down": ARROW_SIZE,
+    "CANCEL selected": BUTTON_SIZE,
+    "CANCEL unselected": BUTTON_SIZE,
+    "CASTLE selected": BUTTON_SIZE,
+    "CASTLE unselected": BUTTON_SIZE,
+    "CONFIRM button selected": BUTTON_SIZE,
+    "CONFIRM button unselected": BUTTON_SIZE,
+}
+SPRITE_ROW_WIDTH = 1024  # pixels, before the sheet wraps to a new row
+
+def hashed_name(name: str, data: bytes) -> str:
+    """URL-safe fingerprinted file name, e.g. "Green arrow up.png" -> green-arrow-up.1a2b3c4d5e6f.png"""
+    stem, ext = os.path.splitext(name)
+    slug = re.sub(r"[^a-z0-9]+", "-", stem.lower()).strip("-")
+    return f"{slug}.{content_hash(data)}{ext}"
+
+def write(dist_dir: str, filename: str, data: bytes) -> Dict[str, Any]:
+    """Write a file and its compressed variants; returns its manifest entry"""
+    with open(os.path.join(dist_dir, filename), "wb") as f:
+        f.write(data)
+    entry = {"file": filename, "hash": content_hash(data), "size": len(data), "encodings": {}}
+    if filename.endswith(COMPRESSIBLE):
+        variants = {"gzip": (".gz", gzip.compress(data, 9, mtime=0))}
+        if brotli is not None:
+            variants["br"] = (".br", brotli.compress(data, quality=11))
+        for coding, (suffix, encoded) in variants.items():
+            # Only keep variants that are actually smaller
+            if len(encoded) < len(data):
+                with open(os.path.join(dist_dir, filename + suffix), "wb") as f:
+                    f.write(encoded)
+                entry["encodings"][coding] = filename + suffix
+    return entry
+
+def build_sprite_sheet(images_dir: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+    """Pack the UI images into one PNG; returns (png bytes, cell map) or None without Pillow"""
+    if Image is None:
+        print("Pillow is not installed: skipping the sprite sheet (pip install pillow)")
+        return None
+
+    cells = {}
+    x = y = row_height = 0
+    layout = []
+    for name, (width, height) in SPRITES.items():
+        path = os.path.join(images_dir, name + ".png")
+        if not os.path.exists(path):
+            continue
+        width, height = width * SPRITE_SCALE, height * SPRITE_SCALE
+        if x + width > SPRITE_ROW_WIDTH:
+            x, y, row_height = 0, y + row_height, 0
+        layout.append((path, name, x, y, width, height))
+        cells[name] = [x, y, width, height]
+        x += width
+        row_height = max(row_height, height)
+
+    sheet_width = max(cell[0] + cell[2] for cell in cells.values())
+    sheet_height = max(cell[1] + cell[3] for cell in cells.values())
+    sheet = Image.new("RGBA", (sheet_width, sheet_height), (0, 0, 0, 0))
+    for path, name, x, y, width, height in layout:
+        with Image.open(path) as image:
+            # The page stretches each image to its box, so the sprite does the same
+            sheet.paste(image.convert("RGBA").resize((width, height), Image.LANCZOS), (x, y))
+
+    buffer = BytesIO()
+    sheet.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue(), {"width": sheet_width, "height": sheet_height,
+                               "scale": SPRITE_SCALE, "cells": cells}
+
+def rewrite_page(html: str, urls: Dict[str, str], asset_map: Dict[str, Any]) -> str:
+    """Point a page at the hashed assets and inject the asset map"""
+    for original, hashed in urls.items():
+        html = html.replace(original, hashed)
+    script = f"<script>window.ASSETS = {json.dumps(asset_map, separators=(',', ':'))};</script>"
+    return html.replace("</head>", f"    {script}\n</head>", 1)
+
+def build(static_dir: str = STATIC_DIR):
+    dist_dir = os.path.join(static_dir, "dist")
+    if os.path.exists(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+    manifest = {"pages": {}, "assets": {}, "sources": {}}
+    urls = {}  # original URL -> hashed URL
+
+    for name in SCRIPTS:
+        with open(os.path.join(static_dir, name), "rb") as f:
+            data = f.read()
+        manifest["sources"][name] = content_hash(data)
+        entry = write(dist_dir, hashed_name(name, data), data)
+        manifest["assets"][name] = entry
+        urls[f"/static/{name}"] = URL_PREFIX + entry["file"]
+
+    images_dir = os.path.join(static_dir, "images")
+    images = {}
+    for name in sorted(os.listdir(images_dir)):
+        with open(os.path.join(images_dir, name), "rb") as f:
+            data = f.read()
+        manifest["sources"][f"images/{name}"] = content_hash(data)
+        entry = write(dist_dir, hashed_name(name, data), data)
+        manifest["assets"][f"images/{name}"] = entry
+        urls[f"/static/images/{name}"] = URL_PREFIX + entry["file"]
+        images[os.path.splitext(name)[0]] = URL_PREFIX + entry["file"]
+
+    asset_map: Dict[str, Any] = {"images": images}
+    sprite = build_sprite_sheet(images_dir)
+    if sprite is not None:
+        data, layout = sprite
+        entry = write(dist_dir, hashed_name("sprites.png", data), data)
+        manifest["assets"]["sprites.png"] = entry
+        asset_map["sprite"] = {"url": URL_PREFIX + entry["file"], **layout}
+
+    for name in PAGES:
+        with open(os.path.join(static_dir, name), "rb") as f:
+            source = f.read()
+        manifest["sources"][name] = content_hash(source)
+        html = source.decode("utf-8")
+        manifest["pages"][name] = write(dist_dir, name, rewrite_page(html, urls, asset_map).encode("utf-8"))
+
+    with open(os.path.join(dist_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    for group in ("pages", "assets"):
+        for name, entry in manifest[group].items():
+            sizes = ", ".join(
+                f"{coding} {os.path.getsize(os.path.join(dist_dir, filename))}"
+                for coding, filename in entry["encodings"].items())
+            print(f"  {name:<36} -> {entry['file']:<40} {entry['size']:>9} bytes{'  (' + sizes + ')' if sizes else ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args()
+    # Paths are relative to this directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    build()
+    print(f"Wrote {DIST_DIR}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Check that importing the server stays within its startup budget.
+
+Runs `python -X importtime -c "import main"` in fresh interpreters and fails
+(exit status 1) when:
+- the cumulative import time of main, best of --runs, exceeds --budget-ms
+- a module that must be loaded lazily (the BCI stack) is imported at startup
+
+Run with: python check_import_time.py [--budget-ms 800] [--runs 3]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, Tuple
+
+# Only needed once a client uses the BCI; see get_bci_registry() in main.py
+LAZY_MODULES = ("numpy", "bci_manager", "bci_registry", "eeg_recorder")
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def measure(module: str) -> Tuple[int, Dict[str, int]]:
+    """Import a module in a fresh interpreter; returns (its cumulative µs, cumulative µs of every module)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"import {module} failed")
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))
+    return modules[module], modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=800.0,
+                        help="maximum cumulative import time of the module")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="imports to run; the fastest one is compared to the budget")
+    parser.add_argument("--top", type=int, default=10,
+                        help="slowest imports to list")
+    args = parser.parse_args()
+    # Imports are resolved relative to this directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    best, modules = min((measure(args.module) for _ in range(max(args.runs, 1))), key=lambda run: run[0])
+    failures = []
+
+    print(f"import {args.module}: {best / 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, micros in sorted(modules.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"  {name:<40} {micros / 1000:8.1f} ms")
+    if best / 1000 > args.budget_ms:
+        failures.append(f"import {args.module} took {best / 1000:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    for name in LAZY_MODULES:
+        if name in modules:
+            failures.append(f"{name} is imported at startup ({modules[name] / 1000:.1f} ms); it must be loaded lazily")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,25 @@
 from typing import List, Dict, Any, Tuple, Optional
+import copy
+import json
+import struct
+
+# Piece codes for the binary state encoding (black pieces have bit 3 set)
+PIECE_CODES = {"pawn": 1, "knight": 2, "bishop": 3, "rook": 4, "queen": 5, "king": 6}
 
 class ChessGame:
     """
     Chess game logic implementation.
     Handles all chess rules, move validation, and game state.
+    
+    The state is versioned: every change bumps `version` and drops the cached
+    encodings, which are then built once and shared by every reader.
     """
     def __init__(self):
+        self.version = 0
+        self.reset()
+
+    def reset(self):
+        """Put the pieces back in their starting positions"""
         self.board = self.init_board()
         self.current_player = "white"
         self.castling_rights = {
@@ -23,6 +37,18 @@ class ChessGame:
             "black": (7, 4)
         }
         self.move_history = []
+        self.undo_stack = []  # positions before each move, for undo_move()
+        self._invalidate()
+
+    def new_game(self):
+        """Start a new game, keeping the version counter monotonic"""
+        self.reset()
+        self.version += 1
+
+    def _invalidate(self):
+        """Drop the cached encodings after the state changed"""
+        self._state_json = None
+        self._state_binary = None
 
     def init_board(self):
         """Initialize an 8x8 chess board with pieces in starting positions"""
@@ -65,6 +91,7 @@ class ChessGame:
     def get_state(self):
         """Get the current game state as a dictionary"""
         return {
+            "version": self.version,
             "board": self.board,
             "currentPlayer": self.current_player,
             "castlingRights": self.castling_rights,
@@ -73,6 +100,41 @@ class ChessGame:
             "stalemate": self.stalemate
         }
     
+    def get_state_json(self) -> str:
+        """The current game state encoded as JSON, built once per version"""
+        if self._state_json is None:
+            self._state_json = json.dumps(self.get_state(), separators=(",", ":"))
+        return self._state_json
+    
+    def get_state_binary(self) -> bytes:
+        """
+        The current game state in a compact binary form, built once per version.
+        
+        Layout (70 bytes, big-endian):
+            uint32  version
+            uint8   flags: bit 0 black to move, 1 check, 2 checkmate, 3 stalemate
+            uint8   castling rights: bit 0 white king side, 1 white queen side,
+                    2 black king side, 3 black queen side
+            64 x uint8  squares in row-major order: 0 empty, else PIECE_CODES value,
+                    +8 for black pieces, +16 once the piece has moved
+        """
+        if self._state_binary is None:
+            flags = ((self.current_player == "black")
+                     | self.check << 1 | self.checkmate << 2 | self.stalemate << 3)
+            castling = (self.castling_rights["white"]["king_side"]
+                        | self.castling_rights["white"]["queen_side"] << 1
+                        | self.castling_rights["black"]["king_side"] << 2
+                        | self.castling_rights["black"]["queen_side"] << 3)
+            squares = bytes(
+                0 if piece is None else
+                PIECE_CODES[piece["type"]]
+                | (8 if piece["color"] == "black" else 0)
+                | (16 if piece.get("has_moved") else 0)
+                for row in self.board for piece in row
+            )
+            self._state_binary = struct.pack(">IBB", self.version, flags, castling) + squares
+        return self._state_binary
+    
     def is_in_bounds(self, row, col):
         """Check if a position is within the board boundaries"""
         return 0 <= row < 8 and 0 <= col < 8
@@ -322,6 +384,9 @@ class ChessGame:
         if move is None:
             return False, "Invalid move"
         
+        # Remember the position so the move can be taken back
+        self.undo_stack.append(self._snapshot())
+        
         # Handle castling
         castling = move.get("castling")
         if castling:
@@ -401,8 +466,39 @@ class ChessGame:
         # Check for check, checkmate, or stalemate
         self.update_game_status()
         
+        self.version += 1
+        self._invalidate()
+        
         return True, "Move successful"
     
+    def _snapshot(self):
+        """Capture everything make_move changes"""
+        return copy.deepcopy({
+            "board": self.board,
+            "current_player": self.current_player,
+            "castling_rights": self.castling_rights,
+            "en_passant_target": self.en_passant_target,
+            "half_move_clock": self.half_move_clock,
+            "full_move_number": self.full_move_number,
+            "check": self.check,
+            "checkmate": self.checkmate,
+            "stalemate": self.stalemate,
+            "king_positions": self.king_positions
+        })
+    
+    def undo_move(self):
+        """Take back the last move"""
+        if not self.undo_stack:
+            return False, "No move to undo"
+        
+        for name, value in self.undo_stack.pop().items():
+            setattr(self, name, value)
+        self.move_history.pop()
+        self.version += 1
+        self._invalidate()
+        
+        return True, "Move undone"
+    
     def update_game_status(self):
         """Update game status (check, checkmate, stalemate)"""
         king_row, king_col = self.king_positions[self.current_player]
@@ -0,0 +1,132 @@
+"""
+permessage-deflate (RFC 7692) configuration for the WebSocket endpoints.
+
+uvicorn only offers an on/off switch for compression. The protocol classes
+here negotiate per-path settings (window sizes, context takeover, zlib level)
+and leave frames below a size threshold uncompressed, so small BCI frames do
+not pay the deflate cost while game states shrink several times over.
+
+Use them by passing the protocol class to uvicorn, e.g.
+uvicorn.run(app, ws=compression.DeflateWebSocketProtocol).
+"""
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+from websockets.extensions.base import ServerExtensionFactory
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import Frame, Opcode, CTRL_OPCODES
+
+class CompressionSettings:
+    """
+    Compression settings for one WebSocket endpoint.
+
+    Args:
+        enabled: Offer permessage-deflate at all
+        min_size: Messages shorter than this many bytes are sent uncompressed
+        server_no_context_takeover: Reset the server's compressor after every message
+            (less memory per connection, worse ratio on repetitive streams)
+        client_no_context_takeover: Ask the client to do the same
+        server_max_window_bits: LZ77 window of the server compressor (9-15)
+        client_max_window_bits: LZ77 window the client may use (9-15)
+        level: zlib compression level (1 = fastest, 9 = smallest)
+        mem_level: zlib memory level (1-9), trades memory per connection for speed
+    """
+    def __init__(self, enabled: bool = True, min_size: int = 512,
+                 server_no_context_takeover: bool = False, client_no_context_takeover: bool = False,
+                 server_max_window_bits: int = 12, client_max_window_bits: int = 12,
+                 level: int = 6, mem_level: int = 5):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.level = level
+        self.mem_level = mem_level
+
+    def factories(self) -> List[ServerExtensionFactory]:
+        """Extension factories to offer during the handshake"""
+        if not self.enabled:
+            return []
+        return [ThresholdPerMessageDeflateFactory(
+            min_size=self.min_size,
+            server_no_context_takeover=self.server_no_context_takeover,
+            client_no_context_takeover=self.client_no_context_takeover,
+            server_max_window_bits=self.server_max_window_bits,
+            client_max_window_bits=self.client_max_window_bits,
+            compress_settings={"level": self.level, "memLevel": self.mem_level}
+        )]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that sends messages below min_size uncompressed"""
+    def __init__(self, *args: Any, min_size: int = 0, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self._skipping = False
+
+    def encode(self, frame: Frame) -> Frame:
+        # Compression is decided per message (the RSV1 bit on its first frame),
+        # and skipping a message leaves the shared compression context untouched
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not Opcode.CONT:
+            self._skipping = frame.fin and len(frame.data) < self.min_size
+        if self._skipping:
+            return frame
+        return super().encode(frame)
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    """Server factory producing ThresholdPerMessageDeflate extensions"""
+    def __init__(self, min_size: int = 0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params: Sequence[Tuple[str, Optional[str]]],
+                               accepted_extensions: Sequence[Any]):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size
+        )
+
+# Game states are ~1.5 kB of repetitive JSON: 5x smaller on their own and far
+# more with context takeover, since consecutive states differ by one move.
+# BCI frames are ~300 bytes and high rate, so they stay under the threshold and
+# skip the per-message CPU cost (see bench_compression.py).
+DEFAULT_SETTINGS = CompressionSettings()
+ENDPOINT_SETTINGS: Dict[str, CompressionSettings] = {
+    "/ws": CompressionSettings(min_size=512),
+    "/bci_ws": CompressionSettings(min_size=1024, server_no_context_takeover=True)
+}
+
+def configure(path: str, settings: CompressionSettings):
+    """Override the compression settings of one WebSocket path"""
+    ENDPOINT_SETTINGS[path] = settings
+
+def settings_for(path: str) -> CompressionSettings:
+    """Compression settings for a request path (query string ignored)"""
+    return ENDPOINT_SETTINGS.get(path.partition("?")[0], DEFAULT_SETTINGS)
+
+try:
+    from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+
+    class DeflateWebSocketProtocol(WebSocketsSansIOProtocol):
+        """uvicorn WebSocket protocol negotiating per-path compression settings"""
+        def handle_connect(self, event):
+            self.conn.available_extensions = settings_for(event.path).factories()
+            super().handle_connect(event)
+except ImportError:
+    # Older uvicorn releases only ship the legacy websockets implementation
+    from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+
+    class DeflateWebSocketProtocol(WebSocketProtocol):
+        """uvicorn WebSocket protocol negotiating per-path compression settings"""
+        async def process_request(self, path, request_headers):
+            self.available_extensions = settings_for(path).factories()
+            return await super().process_request(path, request_headers)
@@ -0,0 +1,246 @@
+"""
+Event loop lag watchdog and sampling profiler.
+
+Everything in this server shares one asyncio loop, so a callback that blocks
+(an FFT, a device read, a slow serialisation) delays every move and
+broadcast. LoopWatchdog measures how late the loop wakes up and, from a
+separate thread, prints the loop thread's stack while it is stuck.
+sample_profile() samples the stacks of the live process for a while and
+returns them in the collapsed format read by flamegraph.pl and speedscope.
+
+For memory, deep_sizeof() and process_memory() size the long-lived
+structures and the process, and TracemallocSnapshots keeps numbered
+tracemalloc snapshots whose differences show where memory keeps growing.
+"""
+import asyncio
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter as StackCounter, deque
+from typing import Dict, Any, List, Optional
+
+from metrics import REGISTRY
+
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer callback")
+LOOP_STALLS = REGISTRY.counter(
+    "event_loop_stalls_total", "Times the event loop was blocked past the watchdog threshold")
+
+class LoopWatchdog:
+    """
+    Measure event loop lag and report callbacks that block the loop.
+
+    A coroutine on the loop records a heartbeat every interval; a watchdog
+    thread checks the heartbeat and, when it is older than the threshold,
+    prints the stack the loop thread is executing (once per stall).
+
+    Args:
+        interval: Seconds between heartbeats
+        threshold: Seconds the loop may be blocked before its stack is logged
+    """
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0  # seconds, last measured
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start the heartbeat on the running loop and the watchdog thread"""
+        self.loop_thread_id = threading.get_ident()
+        self._loop = asyncio.get_running_loop()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            self.lag = max(now - expected, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG_SECONDS.observe(self.lag)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or reported == beat:
+                continue
+            # One report per stall: the heartbeat has not moved since the last one
+            reported = beat
+            # Metrics are only updated on the loop; it runs this once unblocked
+            self._loop.call_soon_threadsafe(LOOP_STALLS.inc)
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "  (no frame)\n"
+            print(f"Event loop blocked for more than {blocked * 1000:.0f} ms, currently running:\n{stack}", end="")
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+def sample_profile(duration: float = 5.0, interval: float = 0.005, all_threads: bool = False,
+                   thread_id: Optional[int] = None) -> str:
+    """
+    Sample thread stacks for a while and return them as collapsed stacks.
+
+    Each output line is "outer;...;inner count". Blocks the calling thread,
+    so run it off the event loop (e.g. with asyncio.to_thread).
+
+    Args:
+        duration: Seconds to sample for
+        interval: Seconds between samples
+        all_threads: Sample every thread, not only thread_id
+        thread_id: Thread to sample (default: the main thread, which runs the event loop)
+    """
+    if thread_id is None:
+        thread_id = threading.main_thread().ident
+    own = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = StackCounter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own or (not all_threads and ident != thread_id):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+def deep_sizeof(obj: Any) -> int:
+    """Approximate bytes held by an object and everything it references (shared objects counted once)"""
+    # Only look for arrays if numpy is loaded; importing it here would defeat lazy BCI loading
+    numpy = sys.modules.get("numpy")
+    ndarray = numpy.ndarray if numpy is not None else ()
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, ndarray):
+            total += sys.getsizeof(item) + (item.nbytes if item.base is None else 0)
+            continue
+        total += sys.getsizeof(item)
+        if isinstance(item, (str, bytes, bytearray, int, float, bool, type(None))):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        if hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+    return total
+
+def process_memory() -> Dict[str, Any]:
+    """Resident set size and garbage collector state of this process"""
+    stats: Dict[str, Any] = {}
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        stats["rss_bytes"] = resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        stats["rss_bytes"] = None
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        stats["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        stats["peak_rss_bytes"] = None
+    stats["gc_objects"] = len(gc.get_objects())
+    stats["gc_counts"] = gc.get_count()
+    stats["tracemalloc"] = tracemalloc.is_tracing()
+    return stats
+
+class TracemallocSnapshots:
+    """
+    Numbered tracemalloc snapshots for leak hunting.
+
+    Start tracing, take a snapshot, let the server run, take another, and
+    diff the two: the allocation sites whose size keeps growing are the leak
+    candidates. Only the most recent max_snapshots are kept, since every
+    snapshot holds a copy of all traces.
+    """
+    def __init__(self, max_snapshots: int = 8):
+        self.max_snapshots = max_snapshots
+        self.snapshots: Dict[int, tracemalloc.Snapshot] = {}
+        self.taken_at: Dict[int, float] = {}
+        self._next_id = 1
+
+    def start(self, frames: int = 10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self):
+        """Stop tracing and drop the snapshots"""
+        tracemalloc.stop()
+        self.snapshots.clear()
+        self.taken_at.clear()
+
+    def take(self) -> Dict[str, Any]:
+        """Take a snapshot; tracing must be running"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self.snapshots[snapshot_id] = snapshot
+        self.taken_at[snapshot_id] = time.time()
+        while len(self.snapshots) > self.max_snapshots:
+            oldest = min(self.snapshots)
+            del self.snapshots[oldest]
+            del self.taken_at[oldest]
+        current, peak = tracemalloc.get_traced_memory()
+        return {"id": snapshot_id, "traced_bytes": current, "peak_traced_bytes": peak}
+
+    def diff(self, first: int, second: int, limit: int = 25, group_by: str = "lineno") -> List[Dict[str, Any]]:
+        """
+        Largest allocation changes between two snapshots.
+
+        Args:
+            first: Id of the earlier snapshot
+            second: Id of the later snapshot
+            limit: Number of allocation sites to return
+            group_by: "lineno", "filename" or "traceback"
+        """
+        stats = self.snapshots[second].compare_to(self.snapshots[first], group_by)
+        return [
+            {
+                "site": [str(frame) for frame in stat.traceback],
+                "size_diff": stat.size_diff,
+                "size": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count
+            }
+            for stat in stats[:limit]
+        ]
@@ -0,0 +1,410 @@
+"""
+EEG signal processing.
+
+Two band power estimators with the same interface:
+
+- BandPowerEngine computes the power of every frequency band from one FFT
+  per window.
+- SlidingDFT tracks only the DFT bins the bands use and updates them with
+  each new chunk of samples, in O(bins x chunk) instead of a full FFT.
+
+Everything that only depends on the window length, sample rate and band
+definitions (taper, frequency bins, which bins belong to which band) is
+computed once when an estimator is created, and each frame writes into
+preallocated arrays. Both read windows from an acquisition.RingBuffer with
+compute_latest() and return the same values for the same window.
+
+FilterBank is the streaming IIR stage in front of them: mains notch,
+band-pass and optional harmonic notches as second-order sections, designed
+with the RBJ audio EQ cookbook formulas and run chunk by chunk with
+persistent per-channel state.
+"""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Frequency bands in Hz, edges included
+BANDS: Dict[str, Tuple[float, float]] = {
+    "delta": (1, 4),
+    "theta": (4, 8),
+    "alpha": (8, 13),
+    "beta": (13, 30),
+    "gamma": (30, 50),
+}
+
+# Power of white noise through the periodic Hann window, relative to no window
+HANN_POWER = 3 / 8
+
+def band_matrix(freqs: np.ndarray, bands: Dict[str, Tuple[float, float]]) -> np.ndarray:
+    """Bins x bands matrix averaging the bins of each band, so that all bands are reduced by one matrix product"""
+    matrix = np.zeros((len(freqs), len(bands)))
+    for column, (low, high) in enumerate(bands.values()):
+        in_band = (freqs >= low) & (freqs <= high)
+        if not in_band.any():
+            raise ValueError(f"No frequency bin between {low} and {high} Hz")
+        matrix[in_band, column] = 1.0 / in_band.sum()
+    return matrix
+
+class BandPowerEngine:
+    """
+    Mean spectral power per band, averaged over channels.
+
+    One engine serves one (channels, window length, sample rate); it keeps
+    its work arrays between calls, so it must not be shared between threads.
+
+    Args:
+        channels: Rows of the windows passed to compute()
+        window_samples: Columns of the windows passed to compute()
+        sample_rate: Samples per second
+        bands: Band name -> (low, high) in Hz, edges included
+        taper: Apply a Hann window (scaled to keep the power of white noise)
+            before the FFT; without it the results match a plain FFT
+    """
+    def __init__(self, channels: int, window_samples: int, sample_rate: float,
+                 bands: Dict[str, Tuple[float, float]] = BANDS, taper: bool = True):
+        self.channels = channels
+        self.window_samples = window_samples
+        self.sample_rate = sample_rate
+        self.bands = dict(bands)
+        self.names = list(self.bands)
+
+        if taper:
+            # Periodic Hann, which SlidingDFT applies in the frequency domain
+            window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(window_samples) / window_samples)
+            self.window = window / np.sqrt(HANN_POWER)
+        else:
+            self.window = np.ones(window_samples)
+
+        self.freqs = np.fft.rfftfreq(window_samples, 1.0 / sample_rate)
+        self.band_matrix = band_matrix(self.freqs, self.bands)
+
+        # Averaging over channels as a product is much cheaper than mean(axis=0)
+        self._channel_weights = np.full(channels, 1.0 / channels)
+        self._tapered = np.empty((channels, window_samples))
+        self._power = np.empty((channels, len(self.freqs)))
+        self._spectrum = np.empty(len(self.freqs))
+        self._band_powers = np.empty(len(self.bands))
+        # Work arrays of compute_batch() by number of windows
+        self._batches: Dict[int, Tuple[np.ndarray, ...]] = {}
+
+    def compute(self, data: np.ndarray) -> np.ndarray:
+        """
+        Band powers of one window.
+
+        Args:
+            data: EEG window, shape (channels, window_samples); not modified
+
+        Returns:
+            Power per band, in the order of self.names. The array is reused by
+            the next call.
+        """
+        np.multiply(data, self.window, out=self._tapered)
+        np.abs(np.fft.rfft(self._tapered, axis=1), out=self._power)
+        np.square(self._power, out=self._power)
+        np.dot(self._channel_weights, self._power, out=self._spectrum)
+        return np.dot(self._spectrum, self.band_matrix, out=self._band_powers)
+
+    def compute_latest(self, buffer: Any) -> Optional[np.ndarray]:
+        """Band powers of the last window in a RingBuffer; None until it holds one"""
+        data = buffer.latest(self.window_samples)
+        return None if data is None else self.compute(data)
+
+    def compute_batch(self, windows: List[np.ndarray]) -> np.ndarray:
+        """
+        Band powers of several windows (e.g. one per headset) at once.
+
+        The windows are tapered into one stacked array and go through a
+        single FFT call and a single band reduction, so the per-call overhead
+        is paid once for all of them.
+
+        Args:
+            windows: (channels, window_samples) arrays; not modified
+
+        Returns:
+            Array of shape (len(windows), bands), reused by the next call
+            with as many windows
+        """
+        count = len(windows)
+        if count == 1:
+            return self.compute(windows[0]).reshape(1, -1)
+        arrays = self._batches.get(count)
+        if arrays is None:
+            bins = len(self.freqs)
+            arrays = self._batches[count] = (
+                np.empty((count, self.channels, self.window_samples)),
+                np.empty((count, self.channels, bins)),
+                np.empty((count, bins)),
+                np.empty((count, len(self.bands)))
+            )
+        tapered, power, spectrum, band_powers = arrays
+        for index, window in enumerate(windows):
+            np.multiply(window, self.window, out=tapered[index])
+        np.abs(np.fft.rfft(tapered, axis=-1), out=power)
+        np.square(power, out=power)
+        np.matmul(self._channel_weights, power, out=spectrum)
+        return np.dot(spectrum, self.band_matrix, out=band_powers)
+
+    def compute_dict(self, data: np.ndarray) -> Dict[str, float]:
+        """Band powers of one window by band name"""
+        return dict(zip(self.names, self.compute(data).tolist()))
+
+class SlidingDFT:
+    """
+    Band powers from incrementally updated DFT bins.
+
+    Only the bins inside the bands are tracked (and their neighbours when
+    tapering, as the Hann window is applied in the frequency domain as
+    0.5 X[k] - 0.25 (X[k-1] + X[k+1])). A chunk of L new samples updates
+    them with the sliding DFT recurrence
+        X[k] <- e^(2 pi i k L / N) X[k] + sum_j (new[j] - old[j]) e^(2 pi i k (L - j) / N)
+    where old are the L samples leaving the window, as one matrix product
+    for all channels. The bins are recomputed directly from the window every
+    resync_samples samples, and whenever the gap since the last update is too
+    long to slide over, which bounds the rounding drift of the recurrence.
+
+    Not thread-safe, like BandPowerEngine.
+
+    Args:
+        channels: Channels of the buffer
+        window_samples: Length of the analysed window
+        sample_rate: Samples per second
+        bands: Band name -> (low, high) in Hz, edges included
+        taper: Apply a Hann window, as in BandPowerEngine
+        resync_samples: Samples between exact recomputations (default: ten windows)
+    """
+    def __init__(self, channels: int, window_samples: int, sample_rate: float,
+                 bands: Dict[str, Tuple[float, float]] = BANDS, taper: bool = True,
+                 resync_samples: Optional[int] = None):
+        self.channels = channels
+        self.window_samples = window_samples
+        self.sample_rate = sample_rate
+        self.bands = dict(bands)
+        self.names = list(self.bands)
+        self.taper = taper
+        self.resync_samples = resync_samples or 10 * window_samples
+
+        freqs = np.fft.rfftfreq(window_samples, 1.0 / sample_rate)
+        matrix = band_matrix(freqs, self.bands)
+        band_bins = np.flatnonzero(matrix.any(axis=1))
+        self.band_matrix = matrix[band_bins]
+        if taper:
+            # Negative neighbours wrap around to the top of the DFT
+            tracked = np.unique(np.concatenate([band_bins - 1, band_bins, band_bins + 1]) % window_samples)
+        else:
+            tracked = band_bins
+        self.bins = tracked
+        # Tracked bins x band bins matrix applying the taper (or just selecting the bins)
+        position = {int(k): i for i, k in enumerate(tracked)}
+        self._kernel = np.zeros((len(tracked), len(band_bins)), dtype=complex)
+        for column, k in enumerate(band_bins):
+            if taper:
+                scale = 1.0 / np.sqrt(HANN_POWER)
+                self._kernel[position[int(k)], column] = 0.5 * scale
+                self._kernel[position[int(k - 1) % window_samples], column] -= 0.25 * scale
+                self._kernel[position[int(k + 1) % window_samples], column] -= 0.25 * scale
+            else:
+                self._kernel[position[int(k)], column] = 1.0
+
+        # Direct DFT of the tracked bins, for resynchronising
+        m = np.arange(window_samples)
+        self._basis = np.exp(-2j * np.pi * np.outer(m, tracked) / window_samples)
+        self._twiddles: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+        self.state = np.zeros((channels, len(tracked)), dtype=complex)
+        self._delta = np.empty((channels, window_samples))
+        self.total: Optional[int] = None  # buffer.total the state corresponds to
+        self.resyncs = 0
+        self._since_resync = 0
+        self._channel_weights = np.full(channels, 1.0 / channels)
+        self._spectrum = np.empty((channels, len(band_bins)), dtype=complex)
+        self._power = np.empty((channels, len(band_bins)))
+        self._mean_power = np.empty(len(band_bins))
+        self._band_powers = np.empty(len(self.bands))
+
+    def _twiddle(self, samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(rotation per bin, samples x bins weights) for a chunk of this length, cached"""
+        cached = self._twiddles.get(samples)
+        if cached is None:
+            steps = samples - np.arange(samples)
+            weights = np.exp(2j * np.pi * np.outer(steps, self.bins) / self.window_samples)
+            rotation = np.exp(2j * np.pi * self.bins * samples / self.window_samples)
+            cached = self._twiddles[samples] = (rotation, weights)
+        return cached
+
+    def resync(self, window: np.ndarray):
+        """Recompute the tracked bins exactly from a (channels, window_samples) window"""
+        np.dot(window, self._basis, out=self.state)
+        self._since_resync = 0
+        self.resyncs += 1
+
+    def update(self, old: np.ndarray, new: np.ndarray):
+        """Slide the window by one chunk: old are the samples leaving it, new the ones entering"""
+        rotation, weights = self._twiddle(new.shape[1])
+        self.state *= rotation
+        np.subtract(new, old, out=self._delta[:, :new.shape[1]])
+        self.state += np.dot(self._delta[:, :new.shape[1]], weights)
+        self._since_resync += new.shape[1]
+
+    def compute_latest(self, buffer: Any) -> Optional[np.ndarray]:
+        """Band powers of the last window in a RingBuffer; None until it holds one"""
+        head, total = buffer.position()
+        window = self.window_samples
+        if total < window:
+            self.total = None
+            return None
+        chunk = total - self.total if self.total is not None else -1
+        if (chunk < 0 or chunk > window or window + chunk > buffer.capacity
+                or self._since_resync + chunk >= self.resync_samples):
+            self.resync(buffer.view(head, window))
+        elif chunk:
+            samples = buffer.view(head, window + chunk)
+            self.update(samples[:, :chunk], samples[:, window:])
+        self.total = total
+        return self.band_powers()
+
+    def band_powers(self) -> np.ndarray:
+        """Band powers of the current state, in the order of self.names; reused by the next call"""
+        np.dot(self.state, self._kernel, out=self._spectrum)
+        np.abs(self._spectrum, out=self._power)
+        np.square(self._power, out=self._power)
+        np.dot(self._channel_weights, self._power, out=self._mean_power)
+        return np.dot(self._mean_power, self.band_matrix, out=self._band_powers)
+
+# Second-order sections are rows [b0, b1, b2, 1, a1, a2], as in scipy.signal
+
+def _biquad(b: Tuple[float, float, float], a: Tuple[float, float, float]) -> List[float]:
+    return [b[0] / a[0], b[1] / a[0], b[2] / a[0], 1.0, a[1] / a[0], a[2] / a[0]]
+
+def notch_section(frequency: float, sample_rate: float, q: float = 30.0) -> List[float]:
+    """Notch at frequency Hz; q is the centre frequency over the -3 dB width"""
+    w0 = 2 * math.pi * frequency / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    return _biquad((1.0, -2 * cos_w0, 1.0), (1 + alpha, -2 * cos_w0, 1 - alpha))
+
+def lowpass_section(cutoff: float, sample_rate: float, q: float = math.sqrt(0.5)) -> List[float]:
+    w0 = 2 * math.pi * cutoff / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    return _biquad(((1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2), (1 + alpha, -2 * cos_w0, 1 - alpha))
+
+def highpass_section(cutoff: float, sample_rate: float, q: float = math.sqrt(0.5)) -> List[float]:
+    w0 = 2 * math.pi * cutoff / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    return _biquad(((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2), (1 + alpha, -2 * cos_w0, 1 - alpha))
+
+def butterworth_qs(order: int) -> List[float]:
+    """Q of each biquad of an even-order Butterworth filter"""
+    if order < 2 or order % 2:
+        raise ValueError("Butterworth order must be even and at least 2")
+    return [1 / (2 * math.cos((2 * k + 1) * math.pi / (2 * order))) for k in range(order // 2)]
+
+def design_sections(sample_rate: float, notch_frequency: float = 50.0, notch_q: float = 30.0,
+                    harmonics: bool = False, band: Optional[Tuple[float, float]] = (0.5, 60.0),
+                    order: int = 4) -> np.ndarray:
+    """
+    Second-order sections of the EEG front end.
+
+    Args:
+        sample_rate: Samples per second
+        notch_frequency: Mains frequency to remove (50 or 60 Hz); 0 for no notch
+        notch_q: Quality factor of the notches
+        harmonics: Also notch every multiple of the mains frequency below Nyquist
+        band: (low, high) Butterworth band-pass edges in Hz, or None
+        order: Order of each edge of the band-pass (even)
+    """
+    nyquist = sample_rate / 2
+    sections = []
+    if notch_frequency > 0:
+        multiple = 1
+        while notch_frequency * multiple < nyquist and (multiple == 1 or harmonics):
+            sections.append(notch_section(notch_frequency * multiple, sample_rate, notch_q))
+            multiple += 1
+    if band is not None:
+        low, high = band
+        if not 0 < low < high < nyquist:
+            raise ValueError(f"Band-pass edges must satisfy 0 < low < high < {nyquist} Hz")
+        for q in butterworth_qs(order):
+            sections.append(highpass_section(low, sample_rate, q))
+            sections.append(lowpass_section(high, sample_rate, q))
+    return np.array(sections).reshape(-1, 6)
+
+def sections_state_space(sos: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    """State-space (A, B, C, D) of a cascade of transposed direct form II sections"""
+    A = np.zeros((0, 0))
+    B = np.zeros(0)
+    C = np.zeros(0)
+    D = 1.0
+    for b0, b1, b2, _, a1, a2 in sos:
+        # One section: y = b0 u + z1, z1' = (b1 - a1 b0) u - a1 z1 + z2, z2' = (b2 - a2 b0) u - a2 z1
+        As = np.array([[-a1, 1.0], [-a2, 0.0]])
+        Bs = np.array([b1 - a1 * b0, b2 - a2 * b0])
+        Cs = np.array([1.0, 0.0])
+        # Its input is the output of the cascade so far
+        n = len(B)
+        A = np.block([[A, np.zeros((n, 2))], [np.outer(Bs, C), As]])
+        B = np.concatenate([B, Bs * D])
+        C = np.concatenate([b0 * C, Cs])
+        D = b0 * D
+    return A, B, C, D
+
+class FilterBank:
+    """
+    Streaming IIR filter applied to every channel.
+
+    The cascade of sections is run as one linear state-space system. For a
+    chunk of L samples the outputs and the next state follow from the
+    current state and the inputs through four matrices that only depend on
+    L, so filtering a chunk is four matrix products for all channels instead
+    of a Python loop over samples and sections. The matrices are computed
+    once per chunk length. The state persists between chunks, so they join
+    without edge transients, and the first chunk starts from the steady
+    state for its first sample.
+
+    Args:
+        channels: Rows of the chunks passed to process()
+        sos: Second-order sections, e.g. from design_sections()
+    """
+    def __init__(self, channels: int, sos: np.ndarray):
+        self.channels = channels
+        self.sos = np.asarray(sos, dtype=float)
+        self.A, self.B, self.C, self.D = sections_state_space(self.sos)
+        self.state: Optional[np.ndarray] = None  # channels x states
+        self._blocks: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def reset(self):
+        self.state = None
+
+    def _block(self, samples: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(state -> outputs, inputs -> outputs, state -> state, inputs -> state), transposed for row vectors"""
+        cached = self._blocks.get(samples)
+        if cached is None:
+            n = len(self.B)
+            powers = [np.eye(n)]
+            for _ in range(samples):
+                powers.append(self.A @ powers[-1])
+            # y[i] = C A^i s + D u[i] + sum_{j<i} C A^(i-1-j) B u[j]
+            observe = np.array([self.C @ powers[i] for i in range(samples)])
+            impulse = np.concatenate([[self.D], [self.C @ powers[i] @ self.B for i in range(samples - 1)]])
+            transfer = np.zeros((samples, samples))
+            for i in range(samples):
+                transfer[i, :i + 1] = impulse[i::-1]
+            # s' = A^L s + sum_j A^(L-1-j) B u[j]
+            control = np.array([powers[samples - 1 - j] @ self.B for j in range(samples)])
+            cached = self._blocks[samples] = (observe.T, transfer.T, powers[samples].T, control)
+        return cached
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Filter a (channels, samples) chunk, continuing from the previous one"""
+        if not len(self.B):
+            return block
+        if self.state is None:
+            # Steady state for a constant input equal to the first sample
+            steady = np.linalg.solve(np.eye(len(self.B)) - self.A, self.B)
+            self.state = np.outer(block[:, 0], steady)
+        observe, transfer, advance, control = self._block(block.shape[1])
+        output = self.state @ observe + block @ transfer
+        self.state = self.state @ advance + block @ control
+        return output
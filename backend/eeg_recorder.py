@@ -0,0 +1,224 @@
+"""
+Raw EEG recordings in memory-mapped files.
+
+The acquisition thread hands every block to EEGRecorder.append(), which only
+puts it on a queue; a "bci-recorder" thread drains the queue in batches and
+copies them into a file preallocated for max_seconds, so reading the device
+never waits for the disk.
+
+File layout:
+- HEADER_SIZE bytes: MAGIC, then a JSON header padded with spaces (channels,
+  sample rate, dtypes, data offset, samples written). It is rewritten on
+  every flush, so a recording cut short is readable up to the last flush.
+- One row per sample from data_offset on: the time.monotonic() timestamp
+  (float64) and the sample of every channel (float32).
+- After stop(), the rows are truncated to the samples written and followed
+  by the markers as JSON at markers_offset.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b"EEGREC1\n"
+HEADER_SIZE = 4096
+# Seconds between flushes of the mapped rows and the header
+FLUSH_INTERVAL = 1.0
+# Blocks waiting for the writer; appends beyond that are dropped
+QUEUE_BLOCKS = 1024
+
+def row_dtype(channels: int) -> np.dtype:
+    return np.dtype([("timestamp", "<f8"), ("samples", "<f4", (channels,))])
+
+class EEGRecorder:
+    """
+    Recording of one device's raw samples, with markers.
+
+    Args:
+        path: File to create (overwritten if it exists)
+        channel_names: Name of every channel, in the order of the device's rows
+        sample_rate: Samples per second of the device
+        max_seconds: Length of the preallocated file; later samples are dropped
+    """
+    def __init__(self, path: str, channel_names: Sequence[str], sample_rate: float, max_seconds: float = 3600.0):
+        self.path = path
+        self.channel_names = list(channel_names)
+        self.sample_rate = sample_rate
+        self.capacity = int(max_seconds * sample_rate)
+        self.dtype = row_dtype(len(self.channel_names))
+        self.samples = 0  # rows written to the file
+        self.received = 0  # samples passed to append(), written or not
+        self.dropped = 0
+        self.markers: List[Dict[str, Any]] = []
+        self.started: Optional[float] = None
+        self._last_timestamp = -np.inf
+        self._queue: queue.Queue = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self._lock = threading.Lock()
+        self._file: Optional[np.memmap] = None
+        self._rows: Optional[np.ndarray] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = np.memmap(self.path, dtype=np.uint8, mode="w+",
+                               shape=(HEADER_SIZE + self.capacity * self.dtype.itemsize,))
+        self._rows = self._file[HEADER_SIZE:].view(self.dtype)
+        self.started = time.time()
+        self._write_header()
+        self._thread = threading.Thread(target=self._run, name="bci-recorder", daemon=True)
+        self._thread.start()
+
+    def append(self, block: np.ndarray, timestamp: Optional[float] = None):
+        """
+        Queue a (channels, samples) block; never blocks.
+
+        Args:
+            block: Raw samples of every channel
+            timestamp: time.monotonic() of the last sample, now by default
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            self.received += block.shape[1]
+        try:
+            self._queue.put_nowait((block, timestamp))
+        except queue.Full:
+            with self._lock:
+                self.dropped += block.shape[1]
+
+    def mark(self, label: str, timestamp: Optional[float] = None) -> Dict[str, Any]:
+        """Add an event marker at the next sample to be appended"""
+        with self._lock:
+            marker = {
+                "sample": self.received,
+                "timestamp": time.monotonic() if timestamp is None else timestamp,
+                "label": label
+            }
+            self.markers.append(marker)
+        return marker
+
+    def stop(self, timeout: float = 5.0):
+        """Write the queued blocks, then truncate the file and append the markers"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        self._file.flush()
+        # The mapping must be gone before the file can be truncated
+        self._rows = None
+        self._file = None
+        markers_offset = HEADER_SIZE + self.samples * self.dtype.itemsize
+        with open(self.path, "r+b") as f:
+            f.truncate(markers_offset)
+            f.seek(markers_offset)
+            f.write(json.dumps(self.markers).encode())
+            f.seek(0)
+            f.write(self._header(markers_offset=markers_offset))
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "recording": self.running,
+            "samples": self.samples,
+            "seconds": self.samples / self.sample_rate,
+            "dropped": self.dropped,
+            "markers": len(self.markers)
+        }
+
+    def _run(self):
+        last_flush = time.monotonic()
+        done = False
+        while not done:
+            try:
+                batch = [self._queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            # Write everything that queued up behind the first block at once
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                done = True
+                batch = batch[:batch.index(None)]
+            for block, timestamp in batch:
+                self._write_block(block, timestamp)
+            if done or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._write_header()
+                last_flush = time.monotonic()
+
+    def _write_block(self, block: np.ndarray, timestamp: float):
+        samples = block.shape[1]
+        count = min(samples, self.capacity - self.samples)
+        if count < samples:
+            with self._lock:
+                self.dropped += samples - count
+        if count <= 0:
+            return
+        rows = self._rows[self.samples:self.samples + count]
+        # Samples are evenly spaced, the last one read at timestamp; a block
+        # read late must not overlap the next one
+        first = max(timestamp - (samples - 1) / self.sample_rate, self._last_timestamp + 1 / self.sample_rate)
+        rows["timestamp"] = first + np.arange(count) / self.sample_rate
+        self._last_timestamp = rows["timestamp"][-1]
+        rows["samples"] = block[:, :count].T
+        self.samples += count
+
+    def _header(self, markers_offset: Optional[int] = None) -> bytes:
+        header = json.dumps({
+            "version": 1,
+            "channels": self.channel_names,
+            "sample_rate": self.sample_rate,
+            "dtype": "float32",
+            "timestamp_dtype": "float64",
+            "clock": "monotonic",
+            "started": self.started,
+            "data_offset": HEADER_SIZE,
+            "row_bytes": self.dtype.itemsize,
+            "samples": self.samples,
+            "dropped": self.dropped,
+            "markers_offset": markers_offset
+        }).encode()
+        if len(MAGIC) + len(header) + 1 > HEADER_SIZE:
+            raise ValueError("EEG recording header too long (too many channel names)")
+        return (MAGIC + header).ljust(HEADER_SIZE - 1) + b"\n"
+
+    def _write_header(self):
+        self._file[:HEADER_SIZE] = np.frombuffer(self._header(), dtype=np.uint8)
+
+def read_recording(path: str) -> Tuple[Dict[str, Any], np.ndarray, List[Dict[str, Any]]]:
+    """
+    Open a recording; returns (header, rows, markers).
+
+    rows is a read-only memory map with "timestamp" and "samples" (samples x
+    channels) fields. markers is empty for a recording that was not stopped.
+    """
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+        if not head.startswith(MAGIC):
+            raise ValueError(f"{path} is not an EEG recording")
+        header = json.loads(head[len(MAGIC):])
+        markers = []
+        if header["markers_offset"] is not None:
+            f.seek(header["markers_offset"])
+            markers = json.loads(f.read())
+    dtype = row_dtype(len(header["channels"]))
+    if not header["samples"]:
+        return header, np.zeros(0, dtype=dtype), markers
+    rows = np.memmap(path, dtype=dtype, mode="r", offset=header["data_offset"], shape=(header["samples"],))
+    return header, rows, markers
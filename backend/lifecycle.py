@@ -0,0 +1,94 @@
+"""
+Readiness and graceful drain for production workers.
+
+A worker reports ready (GET /ready) only after its warm-up hooks have run,
+and stops reporting ready as soon as it receives SIGTERM. Before handing the
+signal on to uvicorn, it tells WebSocket clients to reconnect, flushes their
+queued frames and closes their sockets with 1012 (service restart), so a
+rolling restart drops no messages.
+"""
+import asyncio
+import signal
+import time
+from typing import Callable, Awaitable, List
+
+from websocket_manager import ConnectionManager, SYSTEM_TOPIC
+
+class Lifecycle:
+    """
+    Tracks whether this worker should receive traffic.
+
+    Args:
+        manager: Connection manager whose clients are drained on shutdown
+        drain_timeout: Seconds to wait for queued frames to flush before closing sockets
+    """
+    def __init__(self, manager: ConnectionManager, drain_timeout: float = 5.0):
+        self.manager = manager
+        self.drain_timeout = drain_timeout
+        self.warm_up_hooks: List[Callable[[], Awaitable[None]]] = []
+        self.warmed_up = False
+        self.draining = False
+        self._original_handler = None
+
+    @property
+    def ready(self) -> bool:
+        return self.warmed_up and not self.draining
+
+    def on_warm_up(self, hook: Callable[[], Awaitable[None]]):
+        """Register a coroutine function to run before the worker reports ready"""
+        self.warm_up_hooks.append(hook)
+        return hook
+
+    async def warm_up(self):
+        """Run the warm-up hooks and start reporting ready"""
+        start = time.perf_counter()
+        for hook in self.warm_up_hooks:
+            await hook()
+        self.warmed_up = True
+        print(f"Warm-up finished in {(time.perf_counter() - start) * 1000:.1f} ms, worker is ready")
+
+    def install_drain_handler(self):
+        """
+        Intercept SIGTERM to drain before uvicorn starts its own shutdown.
+        Must be called from the event loop thread after uvicorn installed its handlers.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            self._original_handler = signal.getsignal(signal.SIGTERM)
+            signal.signal(signal.SIGTERM, lambda sig, frame: loop.call_soon_threadsafe(
+                lambda: asyncio.ensure_future(self._drain_and_exit(sig, frame))))
+        except ValueError:
+            # Not the main thread (e.g. a test client); nothing to intercept
+            self._original_handler = None
+
+    async def _drain_and_exit(self, sig, frame):
+        if not self.draining:
+            await self.drain()
+        handler = self._original_handler
+        if callable(handler):
+            handler(sig, frame)
+        elif handler == signal.SIG_DFL:
+            signal.signal(sig, signal.SIG_DFL)
+            signal.raise_signal(sig)
+
+    async def drain(self, retry_ms: int = 1000):
+        """Stop reporting ready, flush every client's queue and close the sockets"""
+        self.draining = True
+        print(f"Draining {len(self.manager.clients)} WebSocket client(s)...")
+        await self.manager.publish(SYSTEM_TOPIC, {
+            "type": "system",
+            "event": "restart",
+            "retry_ms": retry_ms
+        })
+
+        deadline = time.monotonic() + self.drain_timeout
+        while time.monotonic() < deadline and any(
+                client.pending for client in self.manager.clients.values()):
+            await asyncio.sleep(0.05)
+
+        for websocket in list(self.manager.clients):
+            self.manager.disconnect(websocket)
+            try:
+                await asyncio.wait_for(websocket.close(code=1012), timeout=1.0)
+            except Exception:
+                pass
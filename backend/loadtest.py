@@ -0,0 +1,426 @@
+"""
+Load test for the REST and WebSocket paths.
+
+Opens many /ws spectators and runs concurrent players that read the game
+state, ask for valid moves and make moves, then reports throughput, p50/p99
+latency and outcomes per endpoint, and how far apart the spectators received
+each game state broadcast (delivery skew). Outcomes are 429s, moves lost to
+another player's move (conflict) and failures (transport errors and 5xx);
+only failures point at a regression.
+
+By default main.app is driven in-process through ASGI, so the numbers
+measure the application (ConnectionManager, ChessGame, serialisation)
+without sockets and need no network. --url targets a running server over
+loopback instead, and --serve starts one with serve.py first. Rate limiting
+and load shedding are turned off unless --rate-limits is given, since all
+players share one client address; a server given with --url keeps its own
+setting (start it with CHESS_RATE_LIMITS=0 to turn them off).
+
+Run with: python loadtest.py [--spectators 1000] [--players 8] [--duration 10]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Seconds a player waits after a 429 before trying again
+REJECTED_BACKOFF = 0.1
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+class InProcessTransport:
+    """Drives an ASGI app directly: HTTP requests and WebSockets without sockets"""
+    def __init__(self, app):
+        self.app = app
+        self.state: Dict[str, Any] = {}
+        self._ports = itertools.count(10000)
+        self._lifespan_in: asyncio.Queue = asyncio.Queue()
+        self._lifespan_out: asyncio.Queue = asyncio.Queue()
+        self._lifespan_task: Optional[asyncio.Task] = None
+
+    def _scope(self, kind: str, path: str) -> Dict[str, Any]:
+        path, _, query = path.partition("?")
+        return {
+            "type": kind,
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "scheme": "http" if kind == "http" else "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [(b"host", b"loadtest")],
+            "client": ("127.0.0.1", next(self._ports)),
+            "server": ("loadtest", 80),
+            "state": dict(self.state),
+        }
+
+    async def start(self):
+        """Run the app's startup handlers"""
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": self.state}
+        self._lifespan_task = asyncio.create_task(
+            self.app(scope, self._lifespan_in.get, self._lifespan_out.put))
+        await self._lifespan_in.put({"type": "lifespan.startup"})
+        message = await self._lifespan_out.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Application startup failed: {message.get('message')}")
+
+    async def stop(self):
+        await self._lifespan_in.put({"type": "lifespan.shutdown"})
+        await self._lifespan_out.get()
+        await self._lifespan_task
+
+    async def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        scope = self._scope("http", path)
+        scope["method"] = method
+        payload = json.dumps(body).encode() if body is not None else b""
+        if body is not None:
+            scope["headers"] = scope["headers"] + [
+                (b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+        received = False
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal received
+            if received:
+                # Only asked again once the response is complete
+                await asyncio.Event().wait()
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        # Nothing in an in-process request has to wait, so yield as a socket read would;
+        # otherwise one caller could run forever without letting the others in
+        await asyncio.sleep(0)
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    async def connect(self, path: str) -> "InProcessWebSocket":
+        websocket = InProcessWebSocket(self.app, self._scope("websocket", path))
+        await websocket.connect()
+        return websocket
+
+class InProcessWebSocket:
+    """Client end of an in-process ASGI WebSocket"""
+    def __init__(self, app, scope: Dict[str, Any]):
+        self.app = app
+        self.scope = scope
+        self.inbound: asyncio.Queue = asyncio.Queue()
+        self.outbound: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        await self.inbound.put({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(self.scope, self.inbound.get, self.outbound.put))
+        message = await self.outbound.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"WebSocket rejected: {message}")
+
+    async def send(self, text: str):
+        await self.inbound.put({"type": "websocket.receive", "text": text})
+
+    async def recv(self) -> str:
+        message = await self.outbound.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError("WebSocket closed")
+        return message.get("text") or message.get("bytes", b"").decode()
+
+    async def close(self):
+        await self.inbound.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self._task, timeout=1.0)
+        except (asyncio.TimeoutError, Exception):
+            self._task.cancel()
+
+class LoopbackTransport:
+    """Talks to a running server over TCP, with one keep-alive HTTP connection per player"""
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self._connections: Dict[int, Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        for _, writer in self._connections.values():
+            writer.close()
+
+    async def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        # Each player task gets its own connection, reused across requests
+        key = id(asyncio.current_task())
+        if key not in self._connections:
+            self._connections[key] = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self._connections[key]
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n"
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        writer.write(head.encode() + b"\r\n" + payload)
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return status, await reader.readexactly(length)
+
+    async def connect(self, path: str):
+        import websockets
+        return await websockets.connect(f"ws://{self.host}:{self.port}{path}", max_size=None)
+
+class Stats:
+    """Latencies per endpoint and receive times per game state version"""
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}  # transport errors and 5xx responses
+        self.rejected: Dict[str, int] = {}  # 429 from rate limiting or load shedding
+        self.conflicts: Dict[str, int] = {}  # moves lost to another player's move
+        self.move_sent: Dict[int, float] = {}  # version produced -> time the /move was sent
+        self.deliveries: Dict[int, List[float]] = {}  # version -> receive times
+
+    def record(self, endpoint: str, seconds: float, status: int):
+        """Record a request; status 0 stands for a transport error"""
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if status == 429:
+            self.count(self.rejected, endpoint)
+        elif status == 0 or status >= 500:
+            self.count(self.errors, endpoint)
+
+    @staticmethod
+    def count(counter: Dict[str, int], endpoint: str):
+        counter[endpoint] = counter.get(endpoint, 0) + 1
+
+async def spectator(transport, stats: Stats, batch_ms: float, stop: asyncio.Event, ready: asyncio.Queue):
+    """A /ws client recording when each game state version arrives"""
+    path = f"/ws?batch_ms={batch_ms}" if batch_ms else "/ws"
+    websocket = await transport.connect(path)
+    await ready.put(True)
+    try:
+        while not stop.is_set():
+            text = await websocket.recv()
+            now = time.perf_counter()
+            message = json.loads(text)
+            for item in message if isinstance(message, list) else [message]:
+                if item.get("type") == "game_state":
+                    stats.deliveries.setdefault(item["state"]["version"], []).append(now)
+                elif item.get("type") == "ping":
+                    await websocket.send(json.dumps({"type": "pong", "id": item["id"]}))
+    except Exception:
+        if not stop.is_set():
+            raise
+    finally:
+        await websocket.close()
+
+async def timed(transport, stats: Stats, endpoint: str, method: str, path: str,
+                body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+    start = time.perf_counter()
+    try:
+        status, content = await transport.request(method, path, body)
+    except (OSError, asyncio.IncompleteReadError):
+        status, content = 0, b""
+    stats.record(endpoint, time.perf_counter() - start, status)
+    return status, content
+
+async def player(transport, stats: Stats, stop: asyncio.Event, seed: int):
+    """Reads the state, asks for the moves of a random own piece and plays one"""
+    rng = random.Random(seed)
+    while not stop.is_set():
+        status, content = await timed(transport, stats, "GET /game_state", "GET", "/game_state")
+        if status != 200:
+            # Rate limited or shed; back off like a well-behaved client
+            await asyncio.sleep(REJECTED_BACKOFF)
+            continue
+        state = json.loads(content)
+        if state["checkmate"] or state["stalemate"]:
+            await timed(transport, stats, "POST /new_game", "POST", "/new_game")
+            continue
+        squares = [
+            (row, col)
+            for row in range(8) for col in range(8)
+            if state["board"][row][col] and state["board"][row][col]["color"] == state["currentPlayer"]
+        ]
+        row, col = rng.choice(squares)
+        status, content = await timed(
+            transport, stats, "GET /valid_moves", "GET", f"/valid_moves?row={row}&col={col}")
+        if status != 200:
+            await asyncio.sleep(REJECTED_BACKOFF)
+            continue
+        moves = json.loads(content)["moves"]
+        if not moves:
+            continue
+        move = rng.choice(moves)
+        body = {"from_row": row, "from_col": col, "to_row": move["row"], "to_col": move["col"]}
+        if state["board"][row][col]["type"] == "pawn" and move["row"] in (0, 7):
+            body["promotion"] = "queen"
+        sent = time.perf_counter()
+        status, content = await timed(transport, stats, "POST /move", "POST", "/move", body)
+        if status == 200 and json.loads(content).get("success"):
+            # Other players may have moved concurrently; the next version is ours
+            stats.move_sent.setdefault(state["version"] + 1, sent)
+        elif status == 200:
+            # Rejected because another player moved first: expected, not a failure
+            stats.count(stats.conflicts, "POST /move")
+        else:
+            await asyncio.sleep(REJECTED_BACKOFF)
+
+def report(stats: Stats, duration: float, spectators: int) -> Dict[str, Any]:
+    endpoints = {}
+    print(f"\n{'endpoint':<18} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'429':>6} {'conflict':>8} {'failed':>7}")
+    for endpoint, latencies in sorted(stats.latencies.items()):
+        result = {
+            "requests": len(latencies),
+            "throughput": len(latencies) / duration,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "rejected": stats.rejected.get(endpoint, 0),
+            "conflict": stats.conflicts.get(endpoint, 0),
+            "failed": stats.errors.get(endpoint, 0)
+        }
+        endpoints[endpoint] = result
+        print(f"{endpoint:<18} {result['requests']:>9} {result['throughput']:>9.1f} "
+              f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['rejected']:>6} {result['conflict']:>8} {result['failed']:>7}")
+
+    skews, latencies, complete = [], [], 0
+    for version, times in stats.deliveries.items():
+        if len(times) == spectators:
+            complete += 1
+        skews.append(max(times) - min(times))
+        if version in stats.move_sent:
+            latencies.append(max(times) - stats.move_sent[version])
+    broadcast = {
+        "versions": len(stats.deliveries),
+        "complete": complete,
+        "deliveries": sum(len(times) for times in stats.deliveries.values()),
+        "deliveries_per_second": sum(len(times) for times in stats.deliveries.values()) / duration,
+        "skew_p50_ms": percentile(skews, 0.5) * 1000,
+        "skew_p99_ms": percentile(skews, 0.99) * 1000,
+        "move_to_last_delivery_p50_ms": percentile(latencies, 0.5) * 1000,
+        "move_to_last_delivery_p99_ms": percentile(latencies, 0.99) * 1000
+    }
+    print(f"\nbroadcasts: {broadcast['versions']} versions ({broadcast['complete']} reached every spectator), "
+          f"{broadcast['deliveries']} deliveries ({broadcast['deliveries_per_second']:.0f}/s)")
+    print(f"delivery skew: p50 {broadcast['skew_p50_ms']:.2f} ms, p99 {broadcast['skew_p99_ms']:.2f} ms")
+    print(f"move to last delivery: p50 {broadcast['move_to_last_delivery_p50_ms']:.2f} ms, "
+          f"p99 {broadcast['move_to_last_delivery_p99_ms']:.2f} ms")
+    return {"endpoints": endpoints, "broadcast": broadcast}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workers: int, rate_limits: bool) -> Tuple[subprocess.Popen, str]:
+    """Start serve.py on a free loopback port and wait until it is ready"""
+    import urllib.request
+    port = free_port()
+    command = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    if not rate_limits:
+        # The players would otherwise measure the rate limits rather than the server
+        command.append("--no-rate-limits")
+    if workers > 1:
+        # The load test does not use the BCI, which needs a single worker
+        command.append("--no-bci")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if urllib.request.urlopen(url + "/ready").status == 200:
+                return server, url
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The server did not become ready")
+
+async def run(args) -> Dict[str, Any]:
+    if args.url:
+        transport = LoopbackTransport(args.url)
+    else:
+        import main
+        # The players would otherwise measure the rate limits rather than the app
+        main.rate_limiter.enabled = args.rate_limits
+        transport = InProcessTransport(main.app)
+    await transport.start()
+
+    stats = Stats()
+    stop = asyncio.Event()
+    ready: asyncio.Queue = asyncio.Queue()
+    watchers = [asyncio.create_task(spectator(transport, stats, args.batch_ms, stop, ready))
+                for _ in range(args.spectators)]
+    for _ in watchers:
+        await ready.get()
+    print(f"{args.spectators} spectators connected, running {args.players} players for {args.duration:g} s")
+
+    start = time.perf_counter()
+    players = [asyncio.create_task(player(transport, stats, stop, seed)) for seed in range(args.players)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    for result in await asyncio.gather(*players, return_exceptions=True):
+        if isinstance(result, Exception):
+            raise result
+    elapsed = time.perf_counter() - start
+    # Let the last broadcasts arrive before closing the spectators
+    await asyncio.sleep(0.5)
+    for task in watchers:
+        task.cancel()
+    await asyncio.gather(*watchers, return_exceptions=True)
+    await transport.stop()
+    return report(stats, elapsed, args.spectators)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--spectators", type=int, default=1000, help="WebSocket clients on /ws")
+    parser.add_argument("--players", type=int, default=8, help="concurrent REST callers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run the players")
+    parser.add_argument("--batch-ms", type=float, default=0, help="batching tick requested by the spectators")
+    parser.add_argument("--url", help="test a running server over loopback, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--serve", action="store_true", help="start serve.py on a free port and test it")
+    parser.add_argument("--workers", type=int, default=1, help="workers for --serve")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep rate limiting and load shedding on (in-process and --serve)")
+    parser.add_argument("--json", help="also write the results to this file, to compare releases")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    server = None
+    if args.serve:
+        server, args.url = start_server(args.workers, args.rate_limits)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), **results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,67 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from pydantic import ValidationError
 import asyncio
+import hmac
 import json
 import os
-from typing import Dict, Any
+import time
+from typing import Annotated, Dict, Any, Optional
 
 # Direct imports (no relative imports)
-from models import MoveRequest, BCIStatusResponse
-from chess_logic import ChessGame
-from websocket_manager import ConnectionManager
-from bci_manager import BCIManager
+from models import (MoveRequest, ValidMovesRequest, CommandRequest, BCIStatusResponse, BCIBindRequest,
+                    DEVICE_ID_PATTERN)
+from websocket_manager import ConnectionManager, SYSTEM_TOPIC, game_topic, bci_topic
+from broker import create_backend, BROKER_SOCKET_ENV
+from lifecycle import Lifecycle
+from assets import AssetStore
+from metrics import REGISTRY, MetricsMiddleware, timing
+from ratelimit import RateLimiter, RateLimitMiddleware, RateLimit, LOW, NORMAL, HIGH
+from diagnostics import LoopWatchdog, TracemallocSnapshots, sample_profile, process_memory, deep_sizeof
 
 # Create application
 app = FastAPI(title="Chess BCI Game")
 
+# Per-client token buckets for the endpoints a polling client can hammer
+# (rate per second, burst)
+RATE_LIMITS = {
+    "/game_state": RateLimit(20, 40),
+    "/game_state/binary": RateLimit(20, 40),
+    "/valid_moves": RateLimit(30, 60),
+    "/move": RateLimit(10, 20),
+    "/bci/status": RateLimit(20, 40)
+}
+
+# When the event loop lags more than ADMISSION_LAG_LIMIT, spectator polls are
+# shed first, then normal traffic; moves and BCI control are always admitted
+ADMISSION_LAG_LIMIT = 0.05  # seconds
+REQUEST_PRIORITIES = {
+    "/game_state": LOW,
+    "/game_state/binary": LOW,
+    "/connections": LOW,
+    "/valid_moves": NORMAL,
+    "/move": HIGH,
+    "/new_game": HIGH,
+    "/bci/connect": HIGH,
+    "/bci/disconnect": HIGH,
+    "/bci/status": HIGH,
+    "/bci/bind": HIGH,
+    "/bci/record/start": HIGH,
+    "/bci/record/stop": HIGH,
+    "/bci/record/marker": HIGH,
+    "/ready": HIGH
+}
+rate_limiter = RateLimiter(RATE_LIMITS, REQUEST_PRIORITIES,
+                           lag=lambda: watchdog.lag, lag_limit=ADMISSION_LAG_LIMIT)
+# CHESS_RATE_LIMITS=0 turns rate limiting and load shedding off, e.g. for
+# load tests whose players all share the loopback address
+rate_limiter.enabled = os.environ.get("CHESS_RATE_LIMITS") != "0"
+
+# Added first so that it runs inside CORS and 429 responses carry its headers
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -25,161 +71,570 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms and Server-Timing headers
+app.add_middleware(MetricsMiddleware)
+
 # Create instances of our manager classes
 manager = ConnectionManager()
-bci_manager = BCIManager()
-game = ChessGame()
+
+# The BCI stack (numpy and the device wrapper) is only imported on the first
+# /bci/connect, so chess-only workers start without it.
+# CHESS_PRELOAD_BCI=1 loads and warms it up at startup instead.
+bci_registry = None
+bci_producer = None
+PRELOAD_BCI = os.environ.get("CHESS_PRELOAD_BCI") == "1"
+# Devices, bindings and the producer live in this process, so the BCI is only
+# served by a single worker; with the broker (several workers) or
+# CHESS_BCI=0 every /bci route answers 503
+BCI_ENABLED = os.environ.get("CHESS_BCI") != "0" and not os.environ.get(BROKER_SOCKET_ENV)
+MAX_BCI_DEVICES = 8
+# Raw EEG recordings started with /bci/record/start
+RECORDINGS_DIR = os.environ.get("CHESS_RECORDINGS_DIR", "recordings")
+MAX_RECORDING_SECONDS = 4 * 3600  # preallocated up front, about 144 MB at 250 Hz x 8 channels
+
+# Every /bci route takes its device id through this
+DeviceIdQuery = Annotated[str, Query(pattern=DEVICE_ID_PATTERN)]
+
+def require_bci():
+    """Dependency of the /bci routes: 503 unless this worker serves the BCI"""
+    if not BCI_ENABLED:
+        raise HTTPException(status_code=503,
+                            detail="The BCI is only available with a single worker (serve.py --workers 1)")
+
+def get_bci_registry():
+    """The headset registry and its producer, imported and created on first use"""
+    global bci_registry, bci_producer
+    if bci_registry is None:
+        from bci_registry import BCIRegistry, BCIProducer
+        bci_registry = BCIRegistry(max_devices=MAX_BCI_DEVICES)
+        bci_producer = BCIProducer(bci_registry, publish_bci_frame, interval=BCI_PUBLISH_INTERVAL)
+    return bci_registry
+
+def get_bci_device(device_id: str):
+    """A registered headset, or None without creating it"""
+    return bci_registry.devices.get(device_id) if bci_registry is not None else None
+
+# Headset bound to each colour, per game: {game_id: {"white": device_id, ...}}
+bci_bindings: Dict[str, Dict[str, str]] = {}
+
+# Games and broadcasts live behind a backend: in this process by default, or in
+# a broker hub shared by several workers when CHESS_BROKER_SOCKET is set
+backend = create_backend(manager)
+
+# Readiness and graceful drain: /ready answers 200 only after warm-up and
+# until SIGTERM, which first flushes and closes every WebSocket client
+lifecycle = Lifecycle(manager, drain_timeout=5.0)
+
+# Connection gauges are read from the manager when /metrics is scraped
+REGISTRY.gauge("ws_connections", "Open WebSocket connections",
+               collect=lambda: [((), len(manager.clients))])
+REGISTRY.gauge("ws_topic_subscribers", "Sockets subscribed to each topic", ("topic",),
+               collect=lambda: [((topic,), len(subscribers)) for topic, subscribers in manager.topics.items()])
+REGISTRY.gauge("ws_queue_depth", "Frames waiting in WebSocket writer queues (max and total over clients)", ("stat",),
+               collect=lambda: [
+                   (("max",), max((client.pending for client in manager.clients.values()), default=0)),
+                   (("total",), sum(client.pending for client in manager.clients.values()))
+               ])
+
+# Only one game exists for now; its topic is fixed. Headsets are identified by
+# device id, each publishing on its own topic; requests without one use the default
+GAME_ID = "default"
+BCI_DEVICE_ID = "default"
+GAME_TOPIC = game_topic(GAME_ID)
+COLORS = ("white", "black")
+
+# BCI topics are conflated, so the publish rate is not limited by slow clients
+BCI_PUBLISH_INTERVAL = 0.2  # seconds between BCI frames
+
+# Server-driven WebSocket heartbeat; clients that miss a pong are reaped
+HEARTBEAT_INTERVAL = 15.0  # seconds between pings
+HEARTBEAT_TIMEOUT = 10.0  # seconds to wait for the matching pong
+heartbeat_task = None
+
+# Event loop watchdog: callbacks blocking the loop longer than this get their stack printed
+LOOP_LAG_THRESHOLD = 0.1  # seconds
+watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD)
+
+# Sampling profiles run at most this long, one at a time
+PROFILE_MAX_SECONDS = 30.0
+profile_running = False
+
+# The /admin endpoints only exist when CHESS_ADMIN_TOKEN is set, and then
+# need it as "Authorization: Bearer <token>"
+ADMIN_TOKEN = os.environ.get("CHESS_ADMIN_TOKEN")
+
+def require_admin(request: Request):
+    """Dependency of the /admin endpoints: 404 while they are off, 401 without the token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+# tracemalloc snapshots taken through /admin/tracemalloc, for leak hunting
+snapshots = TracemallocSnapshots()
 
 # Ensure the static directory exists
 os.makedirs("static", exist_ok=True)
 
+# Pages and fingerprinted assets (python build_assets.py) are served from memory
+assets = AssetStore("static", "static/dist")
+
 # Serve static files (frontend)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Routes
 @app.get("/")
-async def get_index():
+async def get_index(request: Request):
     """Serve the main frontend page"""
     # Serve our wrapper that will load the original index.html via JavaScript
-    return FileResponse("static/wrapper.html")
+    page = assets.page("wrapper.html")
+    if page is None:
+        return FileResponse("static/wrapper.html")
+    return page.response(request.headers)
 
 @app.get("/original")
-async def get_original_index():
+async def get_original_index(request: Request):
     """Serve the original index.html for debugging"""
-    return FileResponse("static/index.html")
+    page = assets.page("index.html")
+    if page is None:
+        return FileResponse("static/index.html")
+    return page.response(request.headers)
+
+@app.get("/assets/{filename}")
+async def get_asset(filename: str, request: Request):
+    """Serve a content-hashed asset from memory; cached by browsers for a year"""
+    asset = assets.asset(filename)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset.response(request.headers)
 
 @app.get("/game_state")
-async def get_game_state():
-    """Get the current game state"""
-    return game.get_state()
+async def get_game_state(request: Request):
+    """Get the current game state, served from the pre-encoded cache"""
+    etag = backend.etag(GAME_ID)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    with timing("serialise"):
+        body = backend.state_json(GAME_ID)
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+@app.get("/game_state/binary")
+async def get_game_state_binary():
+    """Get the current game state in the compact binary encoding (see ChessGame.get_state_binary)"""
+    return Response(backend.state_binary(GAME_ID), media_type="application/octet-stream",
+                    headers={"ETag": backend.etag(GAME_ID)})
 
 @app.get("/valid_moves")
 async def get_valid_moves(row: int, col: int):
     """Get valid moves for a piece at the specified position"""
-    return {"moves": game.get_valid_moves(row, col)}
+    moves = await backend.valid_moves(GAME_ID, row, col)
+    with timing("serialise"):
+        body = json.dumps({"moves": moves})
+    return Response(body, media_type="application/json")
 
 @app.post("/move")
 async def make_move(move: MoveRequest):
     """Make a move on the board"""
-    success, message = game.make_move(
-        move.from_row, 
-        move.from_col, 
-        move.to_row, 
-        move.to_col, 
-        move.promotion
-    )
+    # The backend publishes the updated game state to the game's subscribers
+    success, message = await backend.make_move(GAME_ID, move.model_dump())
     
     if success:
-        # Broadcast the updated game state to all connected clients
-        await manager.broadcast({
-            "type": "game_state",
-            "state": game.get_state()
-        })
-        
         return {"success": True}
     else:
         return {"success": False, "message": message}
 
+@app.exception_handler(ConnectionError)
+async def broker_unavailable(request: Request, exc: ConnectionError):
+    """The game broker is unreachable (multi-worker mode); it is reconnected in the background"""
+    return Response(json.dumps({"detail": str(exc)}), status_code=503, media_type="application/json",
+                    headers={"Retry-After": "1"})
+
 @app.post("/new_game")
 async def new_game():
     """Start a new game"""
-    global game
-    game = ChessGame()
-    
-    # Broadcast the new game state to all connected clients
-    await manager.broadcast({
-        "type": "game_state",
-        "state": game.get_state()
-    })
-    
+    await backend.new_game(GAME_ID)
     return {"success": True}
 
-@app.post("/bci/connect")
-async def connect_bci():
-    """Connect to the BCI device"""
-    success = bci_manager.connect()
+@app.post("/bci/connect", dependencies=[Depends(require_bci)])
+async def connect_bci(device_id: DeviceIdQuery = BCI_DEVICE_ID):
+    """Connect to a BCI device"""
+    try:
+        device = get_bci_registry().get(device_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    success = device.connect()
     if success:
-        # Start BCI monitoring in background
-        asyncio.create_task(bci_monitoring())
+        # One producer for all devices, however often connect is called
+        bci_producer.start()
     return {"success": success}
 
-@app.post("/bci/disconnect")
-async def disconnect_bci():
-    """Disconnect from the BCI device"""
-    success = bci_manager.disconnect()
+@app.post("/bci/disconnect", dependencies=[Depends(require_bci)])
+async def disconnect_bci(device_id: DeviceIdQuery = BCI_DEVICE_ID):
+    """Disconnect from a BCI device"""
+    device = get_bci_device(device_id)
+    if device is None:
+        return {"success": False}
+    success = device.disconnect()
+    if not bci_registry.connected_devices():
+        bci_producer.stop()
     return {"success": success}
 
-@app.get("/bci/status")
-async def get_bci_status() -> BCIStatusResponse:
-    """Get the current status of the BCI connection"""
+@app.get("/bci/status", dependencies=[Depends(require_bci)])
+async def get_bci_status(device_id: DeviceIdQuery = BCI_DEVICE_ID) -> BCIStatusResponse:
+    """Get the current status of a BCI connection"""
+    device = get_bci_device(device_id)
+    if device is None:
+        return BCIStatusResponse(connected=False)
+    # The producer's last frame, the same values the device's subscribers received
+    frame = bci_producer.latest.get(device_id)
     return BCIStatusResponse(
-        connected=bci_manager.connected,
-        bandpowers=bci_manager.get_bandpowers() if bci_manager.connected else None,
-        focus_level=bci_manager.get_focus_level() if bci_manager.connected else None
+        connected=device.connected,
+        bandpowers=dict(frame.bandpowers) if frame else None,
+        focus_level=frame.focus_level if frame else None,
+        timestamp=frame.timestamp if frame else None
     )
 
+@app.get("/bci/devices", dependencies=[Depends(require_bci)])
+async def get_bci_devices():
+    """Registered devices with their connection state and latest focus level"""
+    if bci_registry is None:
+        return {"devices": []}
+    devices = []
+    for device_id, device in bci_registry.devices.items():
+        frame = bci_producer.latest.get(device_id)
+        devices.append({
+            "device_id": device_id,
+            "connected": device.connected,
+            "focus_level": frame.focus_level if frame else None
+        })
+    return {"devices": devices}
+
+@app.post("/bci/bind", dependencies=[Depends(require_bci)])
+async def bind_bci(request: BCIBindRequest):
+    """Bind a colour of the game to a headset, or unbind it with device_id null"""
+    if request.color not in COLORS:
+        raise HTTPException(status_code=400, detail=f"color must be one of {', '.join(COLORS)}")
+    bindings = bci_bindings.setdefault(GAME_ID, {})
+    if request.device_id is None:
+        bindings.pop(request.color, None)
+    else:
+        bindings[request.color] = request.device_id
+    return {"game_id": GAME_ID, "bindings": bindings}
+
+@app.get("/bci/bindings", dependencies=[Depends(require_bci)])
+async def get_bci_bindings():
+    """Headset bound to each colour of the game"""
+    return {"game_id": GAME_ID, "bindings": bci_bindings.get(GAME_ID, {})}
+
+@app.post("/bci/record/start", dependencies=[Depends(require_bci), Depends(require_admin)])
+async def start_bci_recording(
+        device_id: DeviceIdQuery = BCI_DEVICE_ID,
+        max_seconds: Annotated[float, Query(gt=0, le=MAX_RECORDING_SECONDS)] = 3600.0):
+    """Record the raw samples of a connected headset to a file in RECORDINGS_DIR"""
+    device = get_bci_device(device_id)
+    if device is None:
+        raise HTTPException(status_code=409, detail="The BCI device is not connected")
+    directory = os.path.realpath(RECORDINGS_DIR)
+    path = os.path.realpath(os.path.join(directory, f"{device_id}-{time.strftime('%Y%m%d-%H%M%S')}.eeg"))
+    if os.path.dirname(path) != directory:
+        raise HTTPException(status_code=400, detail="Invalid recording path")
+    try:
+        # Preallocates the file, so keep it off the loop
+        recorder = await asyncio.to_thread(device.start_recording, path, max_seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return recorder.status()
+
+@app.post("/bci/record/stop", dependencies=[Depends(require_bci), Depends(require_admin)])
+async def stop_bci_recording(device_id: DeviceIdQuery = BCI_DEVICE_ID):
+    """Finish a headset's recording"""
+    device = get_bci_device(device_id)
+    recorder = await asyncio.to_thread(device.stop_recording) if device is not None else None
+    if recorder is None:
+        raise HTTPException(status_code=409, detail="The BCI device is not recording")
+    return recorder.status()
+
+@app.post("/bci/record/marker", dependencies=[Depends(require_bci)])
+async def mark_bci_recording(label: str, device_id: DeviceIdQuery = BCI_DEVICE_ID):
+    """Add an event marker to a headset's recording"""
+    device = get_bci_device(device_id)
+    if device is None or device.recorder is None:
+        raise HTTPException(status_code=409, detail="The BCI device is not recording")
+    return device.recorder.mark(label)
+
+@app.get("/bci/record/status", dependencies=[Depends(require_bci)])
+async def get_bci_recording_status(device_id: DeviceIdQuery = BCI_DEVICE_ID):
+    """State of a headset's recording"""
+    device = get_bci_device(device_id)
+    if device is None or device.recorder is None:
+        return {"recording": False}
+    return device.recorder.status()
+
+@app.get("/ready")
+async def get_ready():
+    """Readiness probe: 503 while warming up, draining or cut off from the game broker"""
+    if not lifecycle.ready or not backend.connected:
+        return Response(json.dumps({"ready": False, "draining": lifecycle.draining,
+                                    "broker": backend.connected}),
+                        status_code=503, media_type="application/json")
+    return {"ready": True, "draining": False}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile(seconds: float = 5.0, hz: float = 200.0, all_threads: bool = False):
+    """
+    Sample the live server's stacks for a few seconds.
+    Returns collapsed stacks for flamegraph.pl or speedscope; by default only
+    the event loop thread is sampled.
+    """
+    global profile_running
+    if profile_running:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    interval = 1.0 / min(max(hz, 1.0), 1000.0)
+    profile_running = True
+    try:
+        collapsed = await asyncio.to_thread(
+            sample_profile, seconds, interval, all_threads, watchdog.loop_thread_id)
+    finally:
+        profile_running = False
+    return Response(collapsed, media_type="text/plain",
+                    headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'})
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+async def get_memory():
+    """Sizes of the process and of the structures that grow over a session"""
+    return {
+        "process": process_memory(),
+        "games": backend.memory_stats(),
+        "websockets": manager.memory_stats(),
+        "bci": None if bci_registry is None else {
+            **bci_registry.memory_stats(),
+            "bytes": deep_sizeof(bci_registry)
+        }
+    }
+
+@app.post("/admin/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def start_tracemalloc(frames: int = 10):
+    """Start tracing allocations, keeping this many frames per trace"""
+    snapshots.start(min(max(frames, 1), 50))
+    return {"tracing": True}
+
+@app.post("/admin/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def stop_tracemalloc():
+    """Stop tracing allocations and drop the stored snapshots"""
+    snapshots.stop()
+    return {"tracing": False}
+
+@app.post("/admin/tracemalloc/snapshot", dependencies=[Depends(require_admin)])
+async def take_tracemalloc_snapshot():
+    """Take a numbered snapshot to diff against a later one"""
+    try:
+        return await asyncio.to_thread(snapshots.take)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/admin/tracemalloc/diff", dependencies=[Depends(require_admin)])
+async def diff_tracemalloc_snapshots(first: int, second: int, limit: int = 25, group_by: str = "lineno"):
+    """Allocation sites that grew the most between two snapshots"""
+    if first not in snapshots.snapshots or second not in snapshots.snapshots:
+        raise HTTPException(status_code=404, detail="Unknown snapshot id")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    stats = await asyncio.to_thread(snapshots.diff, first, second, limit, group_by)
+    return {
+        "first": first,
+        "second": second,
+        "seconds_apart": round(snapshots.taken_at[second] - snapshots.taken_at[first], 3),
+        "stats": stats
+    }
+
+@app.get("/connections")
+async def get_connections():
+    """List open WebSocket clients with their subscriptions and heartbeat round-trip times"""
+    return {"connections": manager.connection_stats()}
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for game state updates"""
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, batch_ms: float = 0):
+    """
+    Multiplexed WebSocket endpoint.
+    Clients start subscribed to the game and system topics and can
+    subscribe to or unsubscribe from any topic (e.g. the BCI stream).
+    With ?batch_ms=N, messages are sent as JSON arrays once per N ms tick.
+    """
+    await manager.connect(websocket, [GAME_TOPIC, SYSTEM_TOPIC], batch_ms=batch_ms)
     try:
         # Send the current game state when a client connects
-        await websocket.send_text(json.dumps({
-            "type": "game_state",
-            "state": game.get_state()
-        }))
+        await manager.send_encoded(backend.state_message(GAME_ID), websocket)
         
         while True:
-            # Keep the connection open to receive broadcasts
-            # All game logic is handled through REST endpoints
-            await websocket.receive_text()
+            # Subscription changes and pongs are handled by the manager;
+            # commands are answered on the same socket
+            message = await manager.handle_message(websocket, await websocket.receive_text())
+            if message is not None and message.get("type") == "command":
+                await handle_command(websocket, message)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Also when the connection fails otherwise, so the client's writer and subscriptions go
         manager.disconnect(websocket)
 
+async def handle_command(websocket: WebSocket, message: Dict[str, Any]):
+    """
+    Answer a WebSocket command with a response carrying the same id.
+    
+    Commands: move, legal_moves, new_game, undo. Commands that change the game
+    return the new state in the response, and the other subscribers get it
+    through the game topic, so the caller sees one frame each way.
+    Handlers return "state": True to have the cached state encoding attached.
+    """
+    try:
+        request = CommandRequest.model_validate(message)
+    except ValidationError as e:
+        await manager.send_personal_message({
+            "type": "response",
+            "id": message.get("id"),
+            "success": False,
+            "message": f"Invalid command: {e.errors()[0]['msg']}"
+        }, websocket)
+        return
+    
+    handler = COMMANDS.get(request.command)
+    if handler is None:
+        result = {"success": False, "message": f"Unknown command: {request.command}"}
+    else:
+        try:
+            result = await handler(request.args, websocket)
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            result = {"success": False, "message": f"Invalid {field}: {error['msg']}"}
+        except ConnectionError as e:
+            # The broker hub is gone (multi-worker mode)
+            result = {"success": False, "message": str(e)}
+        except Exception as e:
+            # One bad command must not end the connection
+            print(f"WebSocket command {request.command} failed: {e!r}")
+            result = {"success": False, "message": f"Command failed: {e}"}
+    
+    include_state = result.pop("state", False)
+    text = json.dumps({"type": "response", "id": request.id, **result})
+    if include_state:
+        # Splice in the cached state encoding rather than re-encoding the board
+        text = text[:-1] + ',"state":' + backend.state_json(GAME_ID) + "}"
+    await manager.send_encoded(text, websocket)
+
+async def command_move(args: Dict[str, Any], websocket: WebSocket) -> Dict[str, Any]:
+    move = MoveRequest.model_validate(args)
+    success, message = await backend.make_move(GAME_ID, move.model_dump(), exclude=websocket)
+    if success:
+        return {"success": True, "state": True}
+    return {"success": False, "message": message}
+
+async def command_legal_moves(args: Dict[str, Any], websocket: WebSocket) -> Dict[str, Any]:
+    square = ValidMovesRequest.model_validate(args)
+    return {"success": True, "moves": await backend.valid_moves(GAME_ID, square.row, square.col)}
+
+async def command_new_game(args: Dict[str, Any], websocket: WebSocket) -> Dict[str, Any]:
+    await backend.new_game(GAME_ID, exclude=websocket)
+    return {"success": True, "state": True}
+
+async def command_undo(args: Dict[str, Any], websocket: WebSocket) -> Dict[str, Any]:
+    success, message = await backend.undo(GAME_ID, exclude=websocket)
+    if not success:
+        return {"success": False, "message": message}
+    return {"success": True, "state": True}
+
+COMMANDS = {
+    "move": command_move,
+    "legal_moves": command_legal_moves,
+    "new_game": command_new_game,
+    "undo": command_undo
+}
+
 @app.websocket("/bci_ws")
-async def bci_websocket(websocket: WebSocket):
-    """WebSocket endpoint for BCI data streaming"""
-    await manager.connect(websocket)
+async def bci_websocket(websocket: WebSocket, device_id: DeviceIdQuery = BCI_DEVICE_ID,
+                        color: Optional[str] = None, batch_ms: float = 0):
+    """
+    WebSocket endpoint for BCI data streaming.
+
+    Streams one headset: device_id, or with color the headset bound to that
+    colour of the game (the default device while none is bound).
+    """
+    if not BCI_ENABLED:
+        # See require_bci(); 1013: try again later
+        await websocket.close(code=1013)
+        return
+    if color is not None:
+        device_id = bci_bindings.get(GAME_ID, {}).get(color, BCI_DEVICE_ID)
+    topic = bci_topic(device_id)
+    await manager.connect(websocket, [topic], batch_ms=batch_ms)
+    # Frames come from the producer; start with the current one, if any
+    frame = bci_producer.latest.get(device_id) if bci_producer is not None else None
+    if frame is not None:
+        await manager.send_personal_message({
+            "type": "bci_data",
+            "device_id": device_id,
+            "data": frame.to_dict()
+        }, websocket, topic=topic)
     try:
-        while bci_manager.connected:
-            # Send BCI data to the client
-            bandpowers = bci_manager.get_bandpowers()
-            focus_level = bci_manager.get_focus_level()
-            
-            await websocket.send_text(json.dumps({
-                "type": "bci_data",
-                "data": {
-                    "bandpowers": bandpowers,
-                    "focus_level": focus_level,
-                    "is_focused": bci_manager.is_focused(),
-                    "is_selecting": bci_manager.is_making_selection()
-                }
-            }))
-            
-            await asyncio.sleep(0.2)  # 5 updates per second
+        while True:
+            # Heartbeat pongs and subscription changes
+            await manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
-async def bci_monitoring():
-    """Background task to monitor BCI signals"""
-    if not bci_manager.connected:
+async def publish_bci_frame(device_id: str, frame):
+    """Publish a BCIFrame of the producer to the headset's subscribers on every worker"""
+    await backend.publish(bci_topic(device_id), {
+        "type": "bci_data",
+        "device_id": device_id,
+        "data": frame.to_dict()
+    })
+
+@lifecycle.on_warm_up
+async def warm_up_assets():
+    """Load the pages and built assets into memory"""
+    assets.load()
+
+@lifecycle.on_warm_up
+async def warm_up_game():
+    """Fill the state caches and run move generation once for every square"""
+    backend.state_message(GAME_ID)
+    backend.state_binary(GAME_ID)
+    for row in range(8):
+        for col in range(8):
+            await backend.valid_moves(GAME_ID, row, col)
+
+@lifecycle.on_warm_up
+async def warm_up_bci():
+    """With CHESS_PRELOAD_BCI=1, load the BCI stack and run the FFT band extraction once"""
+    if not PRELOAD_BCI or not BCI_ENABLED:
         return
-    
-    async def bci_callback(data: Dict[str, Any]):
-        """Callback for BCI data updates"""
-        # Broadcast BCI data to all connected clients
-        await manager.broadcast({
-            "type": "bci_data",
-            "data": data
-        })
-    
-    await bci_manager.continuous_monitoring(bci_callback)
+    import numpy as np
+    engine = get_bci_registry().get(BCI_DEVICE_ID).engine
+    engine.compute(np.zeros((engine.channels, engine.window_samples)))
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     """Initialize on server startup"""
+    global heartbeat_task
     print("Chess BCI Server is starting up...")
+    await backend.start()
+    heartbeat_task = asyncio.create_task(
+        manager.heartbeat(HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT))
+    watchdog.start()
+    lifecycle.install_drain_handler()
+    await lifecycle.warm_up()
     
     # Create static directory if it doesn't exist
     os.makedirs("static", exist_ok=True)
@@ -189,10 +644,16 @@ async def startup_event():
 async def shutdown_event():
     """Clean up on server shutdown"""
     print("Chess BCI Server is shutting down...")
-    if bci_manager.connected:
-        bci_manager.disconnect()
+    if heartbeat_task is not None:
+        heartbeat_task.cancel()
+    watchdog.stop()
+    await backend.stop()
+    if bci_registry is not None:
+        bci_producer.stop()
+        bci_registry.disconnect_all()
 
 # Run the application directly if this file is executed
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    from compression import DeflateWebSocketProtocol
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws=DeflateWebSocketProtocol)
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""
+In-process metrics exported in the Prometheus text format.
+
+Counters, gauges and histograms here are plain Python aggregates without
+locks: every update happens on the event loop thread, and an update is a
+couple of list/dict operations, so they can sit in the hot paths (move
+generation, broadcast fan-out, the BCI loop). Values that are cheaper to read
+than to track (sockets per topic, queue depths) are collected at scrape time.
+
+Responses also carry a Server-Timing header: code running inside a request
+adds named phases with timing("engine") / timing("serialise") and the
+middleware reports them next to the total.
+"""
+import bisect
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, from 50 us (cached reads) to 2.5 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base class of a named metric family with optional labels"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """The child metric for one combination of label values"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Counter(Metric):
+    """Monotonic counter"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}"
+                for values, child in self._children.items()]
+
+class Gauge(Counter):
+    """
+    Value that can go up and down.
+    With a collect function the samples are computed at scrape time instead;
+    it returns (label values, value) pairs.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (),
+                 collect: Optional[Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]] = None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self) -> List[str]:
+        if self.collect is None:
+            return super()._samples()
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}"
+                for values, value in self.collect()]
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    @contextmanager
+    def time(self, *label_values: str):
+        """Observe the duration of a block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.labels(*label_values).observe(time.perf_counter() - start)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}")
+            labels = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+class Registry:
+    """Set of metrics rendered together by /metrics"""
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = (), collect=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+REGISTRY = Registry()
+
+# Metrics updated in the hot paths
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+PUBLISH_SECONDS = REGISTRY.histogram(
+    "ws_publish_duration_seconds", "Time to fan a message out to a topic's subscribers", ("topic",))
+PUBLISH_RECIPIENTS = REGISTRY.counter(
+    "ws_publish_recipients_total", "Frames queued or conflated by topic fan-out", ("topic",))
+ENGINE_SECONDS = REGISTRY.histogram(
+    "chess_engine_duration_seconds", "Game engine time per command (legal_moves is one ply of move generation)",
+    ("command",))
+BCI_TICK_SECONDS = REGISTRY.histogram(
+    "bci_tick_duration_seconds", "Processing time of one BCI monitoring tick")
+BCI_TICK_JITTER_SECONDS = REGISTRY.histogram(
+    "bci_tick_jitter_seconds", "Absolute deviation of the BCI tick interval from its target")
+BCI_PRODUCER_RESTARTS = REGISTRY.counter(
+    "bci_producer_restarts_total", "Times the BCI producer loop failed and was restarted")
+
+def topic_kind(topic: str) -> str:
+    """Bounded label for a topic: its prefix (game, bci, system)"""
+    return topic.partition(":")[0]
+
+# Server-Timing phases of the current request, as (name, seconds) pairs
+_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "server_timings", default=None)
+
+def record_timing(name: str, seconds: float):
+    """Add a phase to the Server-Timing header of the current request, if any"""
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+@contextmanager
+def timing(name: str):
+    """Time a block as a Server-Timing phase"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency and adding Server-Timing headers.
+    Routes are labelled by their path template, so /valid_moves?row=1 and
+    ?row=2 share one series; unmatched paths are labelled "unmatched".
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: List[Tuple[str, float]] = []
+        token = _timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = time.perf_counter() - start
+                phases = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings]
+                phases.append(f"app;dur={total * 1000:.3f}")
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", ", ".join(phases).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - start)
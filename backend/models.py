@@ -1,17 +1,39 @@
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Annotated, Optional, List, Dict, Any
+
+# Board coordinates, 0-7
+Square = Annotated[int, Field(ge=0, le=7)]
+
+# BCI device ids end up in topic names and recording file names
+DEVICE_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+DeviceId = Annotated[str, Field(pattern=DEVICE_ID_PATTERN)]
 
 class MoveRequest(BaseModel):
-    from_row: int
-    from_col: int
-    to_row: int
-    to_col: int
+    from_row: Square
+    from_col: Square
+    to_row: Square
+    to_col: Square
     promotion: Optional[str] = None
 
+class ValidMovesRequest(BaseModel):
+    row: Square
+    col: Square
+
+class CommandRequest(BaseModel):
+    """A request sent over the WebSocket, answered with a response carrying the same id"""
+    id: Any
+    command: str
+    args: Dict[str, Any] = {}
+
 class BCIStatusResponse(BaseModel):
     connected: bool
     bandpowers: Optional[Dict[str, float]] = None
     focus_level: Optional[float] = None
+    timestamp: Optional[float] = None
+
+class BCIBindRequest(BaseModel):
+    color: str
+    device_id: Optional[DeviceId] = None
 
 class ValidMovesResponse(BaseModel):
     moves: List[Dict[str, Any]]
@@ -21,6 +43,7 @@ class MoveResponse(BaseModel):
     message: Optional[str] = None
 
 class GameStateResponse(BaseModel):
+    version: int
     board: List[List[Optional[Dict[str, Any]]]]
     currentPlayer: str
     castlingRights: Dict[str, Dict[str, bool]]
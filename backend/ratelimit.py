@@ -0,0 +1,145 @@
+"""
+Per-client rate limiting and load shedding for the HTTP endpoints.
+
+Each (client, path) pair gets a token bucket; a request takes one token and
+is rejected with 429 and Retry-After when the bucket is empty. Independently
+of the buckets, requests are admitted by priority: when the event loop lags
+behind, low-priority traffic (spectators polling the game state) is shed
+first, then normal traffic, while moves and BCI control keep being served.
+
+Rejections are answered by the middleware itself from pre-encoded bytes,
+without reaching the router.
+"""
+import math
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from metrics import REGISTRY
+
+REJECTED = REGISTRY.counter(
+    "http_rejected_total", "Requests answered with 429 by rate limiting or load shedding", ("path", "reason"))
+
+# Request priorities, lowest first
+LOW, NORMAL, HIGH = 0, 1, 2
+
+class RateLimit:
+    """
+    Token bucket parameters.
+
+    Args:
+        rate: Requests per second sustained
+        burst: Bucket size, i.e. requests allowed back to back
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+    def take(self, limit: RateLimit, now: float) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available"""
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / limit.rate
+
+class RateLimiter:
+    """
+    Per-client token buckets and lag-based admission control.
+
+    Args:
+        limits: Token bucket parameters by exact request path
+        priorities: Priority (LOW, NORMAL, HIGH) by exact request path; others are NORMAL
+        lag: Returns the current event loop lag in seconds
+        lag_limit: Above this lag LOW requests are shed; above twice this, NORMAL ones too
+        max_buckets: Idle full buckets are dropped once there are more than this many
+    """
+    def __init__(self, limits: Dict[str, RateLimit], priorities: Optional[Dict[str, int]] = None,
+                 lag: Optional[Callable[[], float]] = None, lag_limit: float = 0.05,
+                 max_buckets: int = 10000):
+        self.limits = limits
+        self.priorities = priorities or {}
+        self.lag = lag
+        self.lag_limit = lag_limit
+        self.max_buckets = max_buckets
+        self.enabled = True
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def check(self, client: str, path: str) -> Tuple[Optional[str], float]:
+        """Returns (None, 0) to admit a request, else (reason, seconds to wait)"""
+        if not self.enabled:
+            return None, 0.0
+        if self._shed(path):
+            return "overloaded", 1.0
+        limit = self.limits.get(path)
+        if limit is None:
+            return None, 0.0
+        now = time.monotonic()
+        key = (client, path)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self._sweep(now)
+            bucket = self.buckets[key] = TokenBucket(limit.burst, now)
+        retry_after = bucket.take(limit, now)
+        if retry_after > 0.0:
+            return "rate_limited", retry_after
+        return None, 0.0
+
+    def _shed(self, path: str) -> bool:
+        if self.lag is None:
+            return False
+        priority = self.priorities.get(path, NORMAL)
+        if priority >= HIGH:
+            return False
+        return self.lag() > self.lag_limit * (2 if priority == NORMAL else 1)
+
+    def _sweep(self, now: float):
+        """Forget buckets that have refilled completely; they are equivalent to new ones"""
+        for key, bucket in list(self.buckets.items()):
+            limit = self.limits[key[1]]
+            if bucket.tokens + (now - bucket.updated) * limit.rate >= limit.burst:
+                del self.buckets[key]
+
+class RateLimitMiddleware:
+    """ASGI middleware answering requests the RateLimiter does not admit with 429"""
+    _BODIES = {
+        "rate_limited": b'{"detail":"Too many requests"}',
+        "overloaded": b'{"detail":"Server overloaded, retry later"}'
+    }
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        client = scope.get("client")
+        reason, retry_after = self.limiter.check(client[0] if client else "", scope["path"])
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        known = path in self.limiter.limits or path in self.limiter.priorities
+        REJECTED.labels(path if known else "other", reason).inc()
+        body = self._BODIES[reason]
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
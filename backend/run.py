@@ -1,5 +1,6 @@
 """
 This script sets up the required directory structure and starts the server.
+It runs uvicorn with --reload for development; use serve.py in production.
 """
 import os
 import shutil
@@ -0,0 +1,114 @@
+"""
+Production launcher for the Chess BCI server.
+
+run.py starts uvicorn with --reload, a file-watching dev server on a single
+process. This script is what should run under load: it runs the given
+number of workers (one by default), uses uvloop/httptools when they are
+installed, sets the listen backlog and keep-alive timeout, and with several
+workers starts the broker hub they share (see broker.py). Workers warm up before /ready reports 200 and drain
+their WebSocket clients on SIGTERM (see lifecycle.py). The BCI stack is
+loaded on the first BCI request unless --preload-bci is given. The BCI state
+(devices, bindings, producer) lives in one process, so several workers are
+only allowed with --no-bci.
+
+Run with: python serve.py [--workers N --no-bci] [--port 8000]
+"""
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+from broker import BROKER_SOCKET_ENV
+
+def available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def start_broker(path: str) -> subprocess.Popen:
+    """Start the broker hub and wait for its socket to appear"""
+    if os.path.exists(path):
+        os.unlink(path)
+    broker = subprocess.Popen([sys.executable, "broker.py", "--socket", path])
+    deadline = time.monotonic() + 10.0
+    while not os.path.exists(path):
+        if broker.poll() is not None or time.monotonic() > deadline:
+            broker.kill()
+            raise RuntimeError("The game broker failed to start")
+        time.sleep(0.05)
+    return broker
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Chess BCI server in production mode")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes; more than one needs --no-bci, since the BCI state "
+                             "is not shared between workers (e.g. one per CPU for the game alone)")
+    parser.add_argument("--backlog", type=int, default=2048,
+                        help="pending connections the listening socket queues")
+    parser.add_argument("--keep-alive", type=int, default=30,
+                        help="seconds an idle HTTP keep-alive connection stays open")
+    parser.add_argument("--graceful-timeout", type=int, default=15,
+                        help="seconds uvicorn waits for open connections after SIGTERM")
+    parser.add_argument("--broker-socket", default="/tmp/chess_broker.sock",
+                        help="Unix socket of the broker hub shared by the workers")
+    parser.add_argument("--preload-bci", action="store_true",
+                        help="load the BCI stack at startup instead of on the first BCI request")
+    parser.add_argument("--no-bci", action="store_true",
+                        help="serve the game only; needed for --workers > 1, since the BCI "
+                             "state is kept in a single process")
+    parser.add_argument("--no-rate-limits", action="store_true",
+                        help="turn rate limiting and load shedding off (load tests from one address)")
+    args = parser.parse_args()
+    if args.workers > 1 and not args.no_bci:
+        parser.error("the BCI devices, bindings and producer live in one process; "
+                     "use --workers 1, or --no-bci to run several workers without the BCI")
+
+    # Module paths below are resolved relative to this directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    loop = "uvloop" if available("uvloop") else "asyncio"
+    http = "httptools" if available("httptools") else "h11"
+    print(f"Starting {args.workers} worker(s) on {args.host}:{args.port} (loop={loop}, http={http})")
+
+    if args.preload_bci:
+        # Inherited by the worker processes, read by main.py
+        os.environ["CHESS_PRELOAD_BCI"] = "1"
+    if args.no_bci:
+        os.environ["CHESS_BCI"] = "0"
+    if args.no_rate_limits:
+        os.environ["CHESS_RATE_LIMITS"] = "0"
+
+    broker = None
+    if args.workers > 1:
+        broker = start_broker(args.broker_socket)
+        # Inherited by the worker processes
+        os.environ[BROKER_SOCKET_ENV] = args.broker_socket
+
+    try:
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            loop=loop,
+            http=http,
+            ws="compression:DeflateWebSocketProtocol",
+            backlog=args.backlog,
+            timeout_keep_alive=args.keep_alive,
+            timeout_graceful_shutdown=args.graceful_timeout,
+            proxy_headers=True,
+            access_log=False
+        )
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
+            if os.path.exists(args.broker_socket):
+                os.unlink(args.broker_socket)
+
+if __name__ == "__main__":
+    main()
@@ -77,6 +77,13 @@ window.addEventListener('load', () => {
     
     socket.onmessage = (event) => {
       const data = JSON.parse(event.data);
+      
+      // Answer server heartbeats so the connection is not reaped
+      if (data.type === 'ping') {
+        socket.send(JSON.stringify({ type: 'pong', id: data.id }));
+        return;
+      }
+      
       console.log('WebSocket message received:', data);
       
       if (data.type === 'game_state') {
@@ -1,30 +1,390 @@
 from fastapi import WebSocket
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set, Iterable, Optional, Deque, Callable
+from collections import deque
+import asyncio
+import itertools
 import json
+import time
+
+from metrics import PUBLISH_SECONDS, PUBLISH_RECIPIENTS, topic_kind
+
+# Upper bound for the per-connection batching tick, in milliseconds
+MAX_BATCH_MS = 100
+
+# Well-known topics. Game and BCI topics are parameterised by id.
+SYSTEM_TOPIC = "system"
+
+def game_topic(game_id: str) -> str:
+    """Topic carrying state updates for one game"""
+    return f"game:{game_id}"
+
+def bci_topic(device_id: str) -> str:
+    """Topic carrying BCI frames for one headset"""
+    return f"bci:{device_id}"
+
+class Client:
+    """
+    Outbound side of one WebSocket connection.
+
+    Event messages are queued and delivered in order. Messages on conflated
+    topics are state, not events: each topic keeps at most one pending frame
+    and a newer frame replaces an unsent one, so a slow client never builds
+    a backlog while a fast client still sees every update.
+
+    With a batch interval set, everything queued within one tick is sent as
+    a single frame holding a JSON array, instead of one frame per message.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, websocket: WebSocket, on_error: Optional[Callable[[WebSocket], None]] = None,
+                 batch_interval: float = 0.0):
+        self.id = next(Client._ids)
+        self.websocket = websocket
+        self.queue: Deque[str] = deque()
+        self.latest: Dict[str, str] = {}
+        self.on_error = on_error
+        self.batch_interval = batch_interval  # seconds; 0 sends each message on its own
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+        # Heartbeat bookkeeping
+        self.ping_id = 0
+        self.ping_sent_at: Optional[float] = None  # set while a ping is unanswered
+        self.rtt: Optional[float] = None  # seconds, from the last pong
+        self.last_seen = self.last_ping_at = time.monotonic()
+
+    def start(self):
+        """Start the writer task"""
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop the writer task and drop anything still pending"""
+        self.closed = True
+        self.queue.clear()
+        self.latest.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    @property
+    def pending(self) -> int:
+        """Number of frames waiting to be written"""
+        return len(self.queue) + len(self.latest)
+
+    def enqueue(self, text: str, urgent: bool = False):
+        """Queue an event message; urgent messages jump ahead of the queue"""
+        if self.closed:
+            return
+        if urgent:
+            self.queue.appendleft(text)
+        else:
+            self.queue.append(text)
+        self._wakeup.set()
+
+    def ping(self):
+        """Send a heartbeat ping; the client must echo its id back in a pong"""
+        self.ping_id += 1
+        self.ping_sent_at = self.last_ping_at = time.monotonic()
+        self.enqueue(json.dumps({"type": "ping", "id": self.ping_id}), urgent=True)
+
+    def pong(self, ping_id: Any):
+        """Record a pong and measure the round-trip time of the matching ping"""
+        now = time.monotonic()
+        self.last_seen = now
+        if ping_id == self.ping_id and self.ping_sent_at is not None:
+            self.rtt = now - self.ping_sent_at
+            self.ping_sent_at = None
+
+    def offer(self, topic: str, text: str):
+        """Replace the pending frame of a conflated topic"""
+        if self.closed:
+            return
+        # Re-inserting moves the topic to the back, so topics are served fairly
+        self.latest.pop(topic, None)
+        self.latest[topic] = text
+        self._wakeup.set()
+
+    def _next(self) -> Optional[str]:
+        if self.queue:
+            return self.queue.popleft()
+        if self.latest:
+            topic = next(iter(self.latest))
+            return self.latest.pop(topic)
+        return None
+
+    def _drain(self) -> List[str]:
+        batch = list(self.queue)
+        self.queue.clear()
+        batch.extend(self.latest.values())
+        self.latest.clear()
+        return batch
+
+    async def _run(self):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                if self.batch_interval > 0:
+                    # Let the tick fill up, then flush it as one frame
+                    await asyncio.sleep(self.batch_interval)
+                    self._wakeup.clear()
+                    batch = self._drain()
+                    if batch:
+                        await self.websocket.send_text("[" + ",".join(batch) + "]")
+                    continue
+                self._wakeup.clear()
+                text = self._next()
+                while text is not None:
+                    await self.websocket.send_text(text)
+                    text = self._next()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone; let the manager forget about it
+            self.closed = True
+            if self.on_error is not None:
+                self.on_error(self.websocket)
 
 class ConnectionManager:
     """
     WebSocket connection manager for real-time communication.
-    Handles both game state updates and BCI data streaming.
+    Clients subscribe to topics (game:{id}, bci:{device}, system) and
+    only receive the messages published to those topics.
     """
-    def __init__(self):
+    def __init__(self, conflated_prefixes: Iterable[str] = ("bci:",)):
         self.active_connections: List[WebSocket] = []
+        self.clients: Dict[WebSocket, Client] = {}
+        self.topics: Dict[str, Set[WebSocket]] = {}
+        self.subscriptions: Dict[WebSocket, Set[str]] = {}
+        self.conflated_prefixes = tuple(conflated_prefixes)
+
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = (), batch_ms: float = 0):
+        """
+        Accept a new WebSocket connection and subscribe it to the initial topics.
 
-    async def connect(self, websocket: WebSocket):
-        """Accept a new WebSocket connection"""
+        Args:
+            websocket: The connection to accept
+            topics: Topics to subscribe to straight away
+            batch_ms: Batching tick in milliseconds (0 disables batching)
+        """
         await websocket.accept()
+        client = Client(websocket, on_error=self.disconnect,
+                        batch_interval=self._batch_interval(batch_ms))
+        client.start()
         self.active_connections.append(websocket)
+        self.clients[websocket] = client
+        self.subscriptions[websocket] = set()
+        for topic in topics:
+            self.subscribe(websocket, topic)
 
     def disconnect(self, websocket: WebSocket):
-        """Remove a WebSocket connection"""
+        """Remove a WebSocket connection and all of its subscriptions"""
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            client.stop()
+        for topic in self.subscriptions.pop(websocket, set()):
+            subscribers = self.topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self.topics[topic]
+
+    def subscribe(self, websocket: WebSocket, topic: str):
+        """Add a connection to the subscriber set of a topic"""
+        if websocket not in self.clients:
+            # Already disconnected or reaped; a late subscribe must not bring it back
+            return
+        self.topics.setdefault(topic, set()).add(websocket)
+        self.subscriptions.setdefault(websocket, set()).add(topic)
+
+    def unsubscribe(self, websocket: WebSocket, topic: str):
+        """Remove a connection from the subscriber set of a topic"""
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self.topics[topic]
+        self.subscriptions.get(websocket, set()).discard(topic)
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.latest.pop(topic, None)
+
+    @staticmethod
+    def _batch_interval(batch_ms: float) -> float:
+        """Clamp a requested batching tick to [0, MAX_BATCH_MS] and convert it to seconds"""
+        return min(max(float(batch_ms), 0.0), MAX_BATCH_MS) / 1000.0
+
+    def is_conflated(self, topic: str) -> bool:
+        """Whether a topic carries latest-value state rather than events"""
+        return topic.startswith(self.conflated_prefixes)
+
+    async def handle_message(self, websocket: WebSocket, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Handle a control message sent by a client.
+
+        Subscription requests look like {"action": "subscribe", "topic": "bci:default"}
+        and are answered with an acknowledgement, as is {"action": "configure",
+        "batch_ms": 5} which changes the batching tick. Heartbeat pongs are consumed here.
+        Anything else is returned to the caller as a decoded message (or None if it
+        was not valid JSON).
+        """
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.last_seen = time.monotonic()
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(message, dict):
+            return None
+
+        if message.get("type") == "pong":
+            if client is not None:
+                client.pong(message.get("id"))
+            return None
+
+        action = message.get("action")
+        if action in ("subscribe", "unsubscribe"):
+            topic = message.get("topic")
+            if not isinstance(topic, str) or not topic:
+                await self.send_personal_message(
+                    {"type": "error", "message": "A topic is required"}, websocket)
+                return None
+            if action == "subscribe":
+                self.subscribe(websocket, topic)
+            else:
+                self.unsubscribe(websocket, topic)
+            await self.send_personal_message(
+                {"type": action + "d", "topic": topic}, websocket)
+            return None
+        if action == "configure":
+            try:
+                batch_interval = self._batch_interval(message.get("batch_ms", 0))
+            except (TypeError, ValueError):
+                await self.send_personal_message(
+                    {"type": "error", "message": "batch_ms must be a number"}, websocket)
+                return None
+            if client is not None:
+                client.batch_interval = batch_interval
+            await self.send_personal_message(
+                {"type": "configured", "batch_ms": batch_interval * 1000}, websocket)
+            return None
+        return message
+
+    async def publish(self, topic: str, message: Dict[str, Any], exclude: Optional[WebSocket] = None):
+        """
+        Send a message to every subscriber of a topic.
+        The message is encoded once and queued on each subscriber's writer.
+        A client that already got the result in a command response can be excluded.
+        """
+        if self.topics.get(topic):
+            await self.publish_encoded(topic, json.dumps({**message, "topic": topic}), exclude)
+
+    async def publish_encoded(self, topic: str, text: str, exclude: Optional[WebSocket] = None):
+        """Like publish(), for a message that is already JSON-encoded (including its topic)"""
+        subscribers = self.topics.get(topic)
+        if not subscribers:
+            return
+        start = time.perf_counter()
+        conflated = self.is_conflated(topic)
+        recipients = 0
+        for connection in subscribers:
+            client = self.clients.get(connection)
+            if connection is exclude or client is None:
+                continue
+            if conflated:
+                client.offer(topic, text)
+            else:
+                client.enqueue(text)
+            recipients += 1
+        kind = topic_kind(topic)
+        PUBLISH_SECONDS.labels(kind).observe(time.perf_counter() - start)
+        PUBLISH_RECIPIENTS.labels(kind).inc(recipients)
 
     async def broadcast(self, message: Dict[str, Any]):
         """Send a message to all connected clients"""
-        for connection in self.active_connections:
-            await connection.send_text(json.dumps(message))
-            
-    async def send_personal_message(self, message: Dict[str, Any], websocket: WebSocket):
-        """Send a message to a specific client"""
-        await websocket.send_text(json.dumps(message))
\ No newline at end of file
+        text = json.dumps(message)
+        for client in self.clients.values():
+            client.enqueue(text)
+
+    async def send_encoded(self, text: str, websocket: WebSocket):
+        """Send an already JSON-encoded message to a specific client"""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.enqueue(text)
+
+    async def send_personal_message(self, message: Dict[str, Any], websocket: WebSocket, topic: Optional[str] = None):
+        """Send a message to a specific client, conflating it if the topic is conflated"""
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        if topic is None:
+            client.enqueue(json.dumps(message))
+        elif self.is_conflated(topic):
+            client.offer(topic, json.dumps({**message, "topic": topic}))
+        else:
+            client.enqueue(json.dumps({**message, "topic": topic}))
+
+    async def heartbeat(self, interval: float = 15.0, timeout: float = 10.0):
+        """
+        Ping every client periodically and reap the ones that stop answering.
+
+        Args:
+            interval: Seconds between pings
+            timeout: Seconds a ping may stay unanswered before the socket is closed
+        """
+        tick = min(interval, timeout)
+        while True:
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+            for websocket, client in list(self.clients.items()):
+                if client.ping_sent_at is not None:
+                    if now - client.ping_sent_at > timeout:
+                        self.reap(websocket)
+                elif now - client.last_ping_at >= interval:
+                    client.ping()
+
+    def reap(self, websocket: WebSocket):
+        """Drop a dead connection and close its socket in the background"""
+        client = self.clients.get(websocket)
+        print(f"Reaping unresponsive WebSocket client {client.id if client else '?'}")
+        self.disconnect(websocket)
+        asyncio.create_task(self._close_quietly(websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        # A half-open peer never completes the closing handshake, so don't wait on it
+        try:
+            await asyncio.wait_for(websocket.close(code=1001), timeout=1.0)
+        except Exception:
+            pass
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """Sizes of the manager's bookkeeping and of the frames waiting in writer queues"""
+        queued_bytes = [
+            sum(len(text) for text in client.queue) + sum(len(text) for text in client.latest.values())
+            for client in self.clients.values()
+        ]
+        return {
+            "connections": len(self.clients),
+            "topics": len(self.topics),
+            "subscriptions": sum(len(topics) for topics in self.subscriptions.values()),
+            "queued_frames": sum(client.pending for client in self.clients.values()),
+            "queued_bytes": sum(queued_bytes),
+            "max_client_queued_bytes": max(queued_bytes, default=0)
+        }
+
+    def connection_stats(self) -> List[Dict[str, Any]]:
+        """Per-client heartbeat and queue statistics"""
+        now = time.monotonic()
+        return [
+            {
+                "id": client.id,
+                "topics": sorted(self.subscriptions.get(websocket, ())),
+                "rtt_ms": round(client.rtt * 1000, 2) if client.rtt is not None else None,
+                "idle_seconds": round(now - client.last_seen, 2),
+                "pending": client.pending
+            }
+            for websocket, client in self.clients.items()
+        ]